@@ -7,19 +7,22 @@ Date: 2025-03-14
 Version: 0.1.0
 """
 
-import requests
 import json
 import time
 import math
-from typing import List, Tuple
+from typing import Iterator, List, Optional, Tuple
 from utils.wwlog import logger
 from utils.wwencrypt import rsa_psw
+from utils.wwcontrol import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from utils.wwmultipart import MultipartFileStream
+from utils.wwthrottle import TokenBucket
 
 
 class WebApi:
     """Web operation api.
     """
-    def __init__(self, url_base: str, email: str, password: str, kb_id: str):
+    def __init__(self, url_base: str, email: str, password: str, kb_id: str, timeout: float = 300.0, batch_size: int = 16,
+                 large_timeout: float = 600.0, upload_rate: float = 0):
         self.url_base = url_base if url_base.endswith("/") else url_base + "/"
         self.email = email
         self.password = password
@@ -27,6 +30,18 @@ class WebApi:
             "Authorization": "",
         }
         self.kb_id = kb_id
+        self.session = None  # created on first request, requests is imported lazily
+        self.encrypted_password = None
+        self.timeout = timeout
+        self.large_timeout = large_timeout  # max seconds without progress for large file uploads
+        self.batch_limiter = AdaptiveLimiter("upload batch", initial = batch_size, maximum = 256)  # files per upload request
+        self.breaker = CircuitBreaker()
+        self.bucket = TokenBucket(upload_rate) if upload_rate else None  # upload bytes per second, 0 for no limit
+
+    def ensure_login(self) -> bool:
+        """Login to web only if no authorization is held.
+        """
+        return bool(self.headers["Authorization"]) or self.login()
 
     def login(self) -> bool:
         """Login to web.
@@ -38,8 +53,9 @@ class WebApi:
         }
 
         try:
-            response = requests.post(url, data = json.dumps(data))
-            code = json.loads(response.text).get("code")
+            response = self.__request("POST", url, data = json.dumps(data))
+            text = response.text
+            code = json.loads(text).get("code")
             if code == 0:
                 logger.debug("Login success.")
                 auth = response.headers.get("Authorization")
@@ -50,107 +66,86 @@ class WebApi:
                     logger.error("Authorization not found.")
                     return False
             else:
-                logger.debug(response.text)
+                logger.debug("Response: %.500s", text)
                 logger.error("Login failed.")
                 return False
         except Exception as e:
             logger.error(e)
-            logger.debug(response.text)
             return False
 
     def get_files(self) -> List[Tuple[str, str]]:
         """Get all files from web.
         """
-        res = []
+        try:
+            return [(doc.get("name"), doc.get("id")) for doc in self.iter_files()]
+        except Exception as e:
+            logger.error(e)
+            return []
+
+    def iter_files(self, orderby: str = "create_time") -> Iterator[dict]:
+        """Iterate over all files on web page by page, without holding the whole listing.
+
+        :param orderby: "create_time" or "update_time", newest first
+        :return: iterator of documents as returned by web
+        """
         page = 1
         max_page = 0  # store max page number
 
         while page:
-            # set max page size to 100
-            url = self.url_base + "document/list?kb_id=" + self.kb_id + f"&keywords=&page={page}&page_size=100"
-            response = requests.get(url, headers=self.headers)
-
-            try:
-                data = json.loads(response.text).get("data")
-                docs = data.get("docs")
-                for doc in docs:
-                    res.append((doc.get("name"), doc.get("id")))
-                # calculate page num
-                if max_page == 0:
-                    max_page = math.ceil(data.get("total") / 100)
-                page = page + 1 if page < max_page else 0
-            except Exception as e:
-                logger.error(e)
-                logger.debug(response.text)
-                res.clear()
-                break
-
-            time.sleep(1)  # I think it's necessary
-
-        return res
+            docs, total = self.list_files(page, orderby)
+            # calculate page num
+            if max_page == 0:
+                max_page = math.ceil(total / 100)
+            yield from docs
+            page = page + 1 if page < max_page else 0
+
+            if page:
+                time.sleep(1)  # I think it's necessary
+
+    def list_files(self, page: int, orderby: str = "create_time") -> Tuple[List[dict], int]:
+        """Get one page of files from web, newest first.
+
+        :param page: page number from 1
+        :param orderby: "create_time" or "update_time"
+        :return: docs of the page and total number of docs
+        """
+        # set max page size to 100
+        url = self.url_base + "document/list?kb_id=" + self.kb_id + f"&keywords=&page={page}&page_size=100&orderby={orderby}&desc=true"
+        response = self.__send("GET", url)
+        try:
+            data = json.loads(response.text).get("data")
+            return data.get("docs"), data.get("total")
+        except Exception:
+            logger.debug("Response: %.500s", response.text)
+            raise
 
     def upload_file(self, file_path: str, file_name: str) -> bool:
         """Upload a file to web.
         """
-        url = self.url_base + "document/upload"
-        data = {
-            "kb_id": self.kb_id
-        }
-
-        try:
-            with open(file_path, "rb") as f:
-                files = {
-                    "file": (file_name, f)
-                }
-                response = requests.post(url, files = files, data = data, headers = self.headers)
-                logger.debug(response.text)
-                return json.loads(response.text).get("code") == 0
-        except Exception as e:
-            logger.error(e)
-            return False
+        return self.upload_files([file_path], [file_name])
 
     def upload_files(self, file_paths: List[str], file_names: List[str]) -> bool:
-        """Upload multiple files to web.
+        """Upload multiple files to web, streaming them from disk.
         """
-        url = self.url_base + "document/upload"
-        data = {
-            "kb_id": self.kb_id
-        }
-        
-        files = []
-
-        try:
-            for file_path, file_name in zip(file_paths, file_names):
-                f = open(file_path, "rb")
-                files.append(("file", (file_name, f)))
-
-            response = requests.post(url, files = files, data = data, headers = self.headers)
-            logger.debug(response.text)
-            return json.loads(response.text).get("code") == 0
-        except Exception as e:
-            logger.error("uploads")
-            logger.error(e)
-            return False
-        finally:
-            # close all files
-            for _, (_, file_obj) in files:
-                file_obj.close()
+        return self.__upload(list(zip(file_paths, file_names)), limiter = self.batch_limiter)
 
+    def upload_large_file(self, file_path: str, file_name: str) -> bool:
+        """Upload a large file to web alone, streaming it from disk.
+        """
+        return self.__upload([(file_path, file_name)], timeout = self.large_timeout)
 
-    def delete_file(self, file_id: str) -> bool:
-        """Delete a file from web.
+    def __upload(self, files: List[Tuple[str, str]], **kwargs) -> bool:
+        """Upload files in one streamed multipart body, throttled on the wire if an upload rate is set.
         """
-        url = self.url_base + "document/rm"
-        data = {
-            "doc_id": [
-                file_id
-            ]
-        }
+        url = self.url_base + "document/upload"
 
         try:
-            response = requests.post(url, data = json.dumps(data), headers = self.headers)
-            logger.debug(response.text)
-            return json.loads(response.text).get("code") == 0
+            throttle = self.bucket.consume if self.bucket else None
+            with MultipartFileStream(files, fields = {"kb_id": self.kb_id}, throttle = throttle) as stream:
+                response = self.__send("POST", url, data = stream, headers = {"Content-Type": stream.content_type}, **kwargs)
+                text = response.text
+                logger.debug("Response: %.500s", text)
+                return json.loads(text).get("code") == 0
         except Exception as e:
             logger.error(e)
             return False
@@ -164,9 +159,10 @@ class WebApi:
         }
 
         try:
-            response = requests.post(url, data = json.dumps(data), headers = self.headers)
-            logger.debug(response.text)
-            return json.loads(response.text).get("code") == 0
+            response = self.__send("POST", url, data = json.dumps(data))
+            text = response.text
+            logger.debug("Response: %.500s", text)
+            return json.loads(text).get("code") == 0
         except Exception as e:
             logger.error(e)
             return False
@@ -184,9 +180,10 @@ class WebApi:
         }
 
         try:
-            response = requests.post(url, data = json.dumps(data), headers = self.headers)
-            logger.debug(response.text)
-            return json.loads(response.text).get("code") == 0
+            response = self.__send("POST", url, data = json.dumps(data))
+            text = response.text
+            logger.debug("Response: %.500s", text)
+            return json.loads(text).get("code") == 0
         except Exception as e:
             logger.error(e)
             return False
@@ -202,9 +199,10 @@ class WebApi:
         }
         
         try:
-            response = requests.post(url, data = json.dumps(data), headers = self.headers)
-            logger.debug(response.text)
-            return json.loads(response.text).get("code") == 0
+            response = self.__send("POST", url, data = json.dumps(data))
+            text = response.text
+            logger.debug("Response: %.500s", text)
+            return json.loads(text).get("code") == 0
         except Exception as e:
             logger.error(e)
             return False
@@ -222,9 +220,10 @@ class WebApi:
         }
         
         try:
-            response = requests.post(url, data = json.dumps(data), headers = self.headers)
-            logger.debug(response.text)
-            return json.loads(response.text).get("code") == 0
+            response = self.__send("POST", url, data = json.dumps(data))
+            text = response.text
+            logger.debug("Response: %.500s", text)
+            return json.loads(text).get("code") == 0
         except Exception as e:
             logger.error(e)
             return False
@@ -240,17 +239,85 @@ class WebApi:
         }
         
         try:
-            response = requests.post(url, data = json.dumps(data), headers = self.headers)
-            logger.debug(response.text)
-            return json.loads(response.text).get("code") == 0
+            response = self.__send("POST", url, data = json.dumps(data))
+            text = response.text
+            logger.debug("Response: %.500s", text)
+            return json.loads(text).get("code") == 0
         except Exception as e:
             logger.error(e)
             return False
 
+    def __get_session(self):
+        """Get http session, create it on first use.
+        """
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        return self.session
+
+    def __send(self, method: str, url: str, limiter: Optional[AdaptiveLimiter] = None, **kwargs):
+        """Send a request, login again and retry once if authorization expired.
+        """
+        headers = kwargs.pop("headers", {})
+        response = self.__request(method, url, limiter, headers = {**self.headers, **headers}, **kwargs)
+        if self.__unauthorized(response):
+            logger.info("Authorization expired, login again.")
+            self.headers["Authorization"] = ""
+            if self.login():
+                # rewind bodies already consumed by the first attempt
+                if hasattr(kwargs.get("data"), "seek"):
+                    kwargs["data"].seek(0)
+                response = self.__request(method, url, limiter, headers = {**self.headers, **headers}, **kwargs)
+        return response
+
+    def __request(self, method: str, url: str, limiter: Optional[AdaptiveLimiter] = None, **kwargs):
+        """Send a request through the circuit breaker and report its outcome.
+
+        :param limiter: limiter of the upload sent by this request, if any
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit open, {url} not requested.")
+
+        try:
+            kwargs.setdefault("timeout", self.timeout)
+            response = self.__get_session().request(method, url, **kwargs)
+        except Exception:
+            # timeout or connection failure
+            self.breaker.failure()
+            if limiter:
+                limiter.overload()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        if limiter:
+            if response.status_code == 429 or response.status_code >= 500:
+                limiter.overload()
+            else:
+                # upload latency follows bytes sent and throttling, only errors tell server load
+                limiter.success()
+        return response
+
+    @staticmethod
+    def __unauthorized(response) -> bool:
+        """Check whether web rejected the authorization.
+        """
+        if response.status_code == 401:
+            return True
+        try:
+            return json.loads(response.text).get("code") == 401
+        except Exception:
+            return False
+
     def __encrypt_passwd(self) -> str:
-        """Encrypt password.
+        """Encrypt password, only once.
         """
+        if self.encrypted_password:
+            return self.encrypted_password
         public_key = """-----BEGIN PUBLIC KEY-----
 MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEArq9XTUSeYr2+N1h3Afl/z8Dse/2yD0ZGrKwx+EEEcdsBLca9Ynmx3nIB5obmLlSfmskLpBo0UACBmB5rEjBp2Q2f3AG3Hjd4B+gNCG6BDaawuDlgANIhGnaTLrIqWrrcm4EMzJOnAOI1fgzJRsOOUEfaS318Eq9OVO3apEyCCt0lOQK6PuksduOjVxtltDav+guVAA068NrPYmRNabVKRNLJpL8w4D44sfth5RvZ3q9t+6RTArpEtc5sh5ChzvqPOzKGMXW83C95TxmXqpbK6olN4RevSfVjEAgCydH6HN6OhtOQEcnrU97r9H0iZOWwbw3pVrZiUkuRD1R56Wzs2wIDAQAB
 -----END PUBLIC KEY-----"""
-        return rsa_psw(self.password, public_key)
+        self.encrypted_password = rsa_psw(self.password, public_key)
+        return self.encrypted_password
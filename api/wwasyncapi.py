@@ -0,0 +1,382 @@
+"""
+Module File: wwasyncapi.py
+Description: This module contains asynchronous web operation.
+
+Author: Icingworld
+Date: 2025-03-24
+Version: 0.1.0
+"""
+
+import aiohttp
+import asyncio
+import json
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+from utils.wwlog import logger
+from utils.wwencrypt import rsa_psw
+from utils.wwcontrol import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from utils.wwthrottle import TokenBucket
+
+
+class AsyncWebApi:
+    """Asynchronous web operation api, same surface as WebApi.
+    """
+    def __init__(self, url_base: str, email: str, password: str, kb_id: str, concurrency: int = 8, batch_size: int = 16,
+                 timeout: float = 300.0, chunk_size: int = 64 * 1024, large_concurrency: int = 2, large_timeout: float = 600.0,
+                 upload_rate: float = 0, max_concurrency: int = 256, connection_limit: int = 0):
+        """
+        :param concurrency: initial in-flight limit, adapted between 1 and max_concurrency
+        :param connection_limit: max open connections, 0 for max_concurrency plus large_concurrency
+        """
+        self.url_base = url_base if url_base.endswith("/") else url_base + "/"
+        self.email = email
+        self.password = password
+        self.headers = {
+            "Authorization": "",
+        }
+        self.kb_id = kb_id
+        self.chunk_size = chunk_size
+        self.timeout = aiohttp.ClientTimeout(total = timeout)
+        self.limiter = AdaptiveLimiter("in-flight", initial = concurrency, maximum = max_concurrency)  # in-flight requests
+        self.connection_limit = connection_limit or max_concurrency + large_concurrency
+        self.batch_limiter = AdaptiveLimiter("upload batch", initial = batch_size, maximum = 256)  # files per upload request
+        self.breaker = CircuitBreaker()
+        self.bucket = TokenBucket(upload_rate) if upload_rate else None  # upload bytes per second, 0 for no limit
+        self.in_flight = 0
+        self.large_slots = asyncio.Semaphore(large_concurrency)  # large file uploads have their own lane
+        # no total timeout for large files, only for stalled reads
+        self.large_timeout = aiohttp.ClientTimeout(total = None, sock_connect = timeout, sock_read = large_timeout)
+        self.slot_changed = asyncio.Condition()
+        self.login_lock = asyncio.Lock()  # only one re-login for concurrent rejected requests
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.encrypted_password = None
+
+    async def open(self) -> None:
+        """Open http session if not opened.
+
+        :return: None
+        """
+        if self.session is None or self.session.closed:
+            # aiohttp allows 100 connections by default, below the in-flight limit
+            self.session = aiohttp.ClientSession(timeout = self.timeout,
+                                                 connector = aiohttp.TCPConnector(limit = self.connection_limit))
+
+    async def close(self) -> None:
+        """Close http session if opened.
+
+        :return: None
+        """
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def __aenter__(self) -> "AsyncWebApi":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def ensure_login(self) -> bool:
+        """Login to web only if no authorization is held.
+        """
+        return bool(self.headers["Authorization"]) or await self.login()
+
+    async def login(self) -> bool:
+        """Login to web.
+        """
+        url = self.url_base + "user/login"
+        data = {
+            "email": self.email,
+            "password": self.__encrypt_passwd()
+        }
+
+        try:
+            _, text, auth = await self.__request("POST", url, json.dumps(data))
+            code = json.loads(text).get("code")
+            if code == 0:
+                logger.debug("Login success.")
+                if auth:
+                    self.headers["Authorization"] = auth
+                    return True
+                else:
+                    logger.error("Authorization not found.")
+                    return False
+            else:
+                logger.debug("Response: %.500s", text)
+                logger.error("Login failed.")
+                return False
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    async def get_files(self) -> List[Tuple[str, str]]:
+        """Get all files from web, fetching pages concurrently.
+        """
+        try:
+            docs = await self.get_docs()
+        except Exception as e:
+            logger.error(e)
+            return []
+        return [(doc.get("name"), doc.get("id")) for doc in docs]
+
+    async def get_docs(self, orderby: str = "create_time") -> List[dict]:
+        """Get all documents from web, fetching pages concurrently.
+
+        :param orderby: "create_time" or "update_time", newest first
+        :return: documents as returned by web
+        """
+        docs, total = await self.list_files(1, orderby)
+        max_page = math.ceil(total / 100)
+        # first page tells the total, fetch the rest at once
+        pages = await asyncio.gather(*(self.list_files(page, orderby) for page in range(2, max_page + 1)))
+        for page_docs, _ in pages:
+            docs.extend(page_docs)
+        return docs
+
+    async def upload_file(self, file_path: str, file_name: str) -> bool:
+        """Upload a file to web.
+        """
+        return await self.upload_files([file_path], [file_name])
+
+    async def upload_files(self, file_paths: List[str], file_names: List[str]) -> bool:
+        """Upload multiple files to web, streaming their contents.
+        """
+        url = self.url_base + "document/upload"
+
+        def build_form() -> aiohttp.FormData:
+            # keep relative paths in file names unquoted, same as requests does
+            form = aiohttp.FormData(quote_fields = False)
+            form.add_field("kb_id", self.kb_id)
+            for file_path, file_name in zip(file_paths, file_names):
+                form.add_field("file", self.__read_file(file_path), filename = file_name)
+            return form
+
+        try:
+            # streamed bodies can't be replayed, build a new form for each attempt
+            return await self.__post(url, build_form, self.batch_limiter)
+        except Exception as e:
+            logger.error("uploads")
+            logger.error(e)
+            return False
+
+    async def upload_large_file(self, file_path: str, file_name: str) -> bool:
+        """Upload a large file to web alone, streaming it in the large file lane.
+        """
+        url = self.url_base + "document/upload"
+
+        def build_form() -> aiohttp.FormData:
+            form = aiohttp.FormData(quote_fields = False)
+            form.add_field("kb_id", self.kb_id)
+            form.add_field("file", self.__read_file(file_path), filename = file_name)
+            return form
+
+        try:
+            return await self.__post(url, build_form, large = True)
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    async def delete_file(self, file_id: str) -> bool:
+        """Delete a file from web.
+        """
+        return await self.delete_files([file_id])
+
+    async def delete_files(self, file_ids: List[str]) -> bool:
+        """Delete files from web.
+        """
+        url = self.url_base + "document/rm"
+        data = {
+            "doc_id": file_ids
+        }
+
+        try:
+            return await self.__post(url, json.dumps(data))
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    async def parse_file(self, file_id: str) -> bool:
+        """Start a file's parsing.
+        """
+        return await self.parse_files([file_id])
+
+    async def parse_files(self, file_ids: List[str]) -> bool:
+        """Start files' parsing.
+        """
+        url = self.url_base + "document/run"
+        data = {
+            "doc_ids": file_ids,
+            "run": 1,
+            "delete": "false"
+        }
+
+        try:
+            return await self.__post(url, json.dumps(data))
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    async def cancel_file(self, file_id: str) -> bool:
+        """Cancel a file's parsing.
+        """
+        return await self.cancel_files([file_id])
+
+    async def cancel_files(self, file_ids: List[str]) -> bool:
+        """Cancel files' parsing.
+        """
+        url = self.url_base + "document/run"
+        data = {
+            "doc_ids": file_ids,
+            "run": 2,
+            "delete": "false"
+        }
+
+        try:
+            return await self.__post(url, json.dumps(data))
+        except Exception as e:
+            logger.error(e)
+            return False
+
+    async def __post(self, url: str, data, limiter: Optional[AdaptiveLimiter] = None, large: bool = False) -> bool:
+        """Post data to web and check the returned code.
+
+        :param data: request body, or a callable building it
+        :param limiter: limiter of the upload sent by this request, if any
+        :param large: send in the large file lane
+        """
+        text = await self.__send("POST", url, data, limiter, large)
+        logger.debug("Response: %.500s", text)
+        return json.loads(text).get("code") == 0
+
+    async def __send(self, method: str, url: str, data = None, limiter: Optional[AdaptiveLimiter] = None, large: bool = False) -> str:
+        """Send a request, login again and retry once if authorization expired.
+
+        :return: response text
+        """
+        for attempt in range(2):
+            auth = self.headers["Authorization"]
+            body = data() if callable(data) else data
+            status, text, _ = await self.__request(method, url, body, limiter, headers = self.headers, large = large)
+            if attempt or not self.__unauthorized(status, text):
+                break
+            async with self.login_lock:
+                # another request may have logged in already
+                if self.headers["Authorization"] == auth:
+                    logger.info("Authorization expired, login again.")
+                    self.headers["Authorization"] = ""
+                    if not await self.login():
+                        break
+        return text
+
+    async def __request(self, method: str, url: str, data = None, limiter: Optional[AdaptiveLimiter] = None,
+                        headers: Optional[dict] = None, large: bool = False) -> Tuple[int, str, Optional[str]]:
+        """Send a request through the circuit breaker within the in-flight limit, and report its outcome.
+
+        :param large: send in the large file lane, outside of the adaptive in-flight limit
+        :return: response status, text and Authorization header
+        """
+        await self.open()
+        # large file latency follows file size, it says nothing about server load
+        limiters = (limiter,) if large else (self.limiter, limiter)
+        async with (self.large_slots if large else self.__slot()):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit open, {url} not requested.")
+
+            start = time.monotonic()
+            try:
+                timeout = self.large_timeout if large else self.timeout
+                async with self.session.request(method, url, data = data, headers = headers, timeout = timeout) as response:
+                    status = response.status
+                    text = await response.text()
+                    auth = response.headers.get("Authorization")
+            except BaseException:
+                # timeout or connection failure, also on cancel so a probe never stays half-open
+                self.breaker.failure()
+                for each in limiters:
+                    if each:
+                        each.overload()
+                raise
+            # upload latency follows bytes sent and throttling, only errors tell server load
+            latency = None if limiter else time.monotonic() - start
+
+            # report before releasing the slot, requests waiting on a probe see its outcome
+            if status >= 500:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            for each in limiters:
+                if not each:
+                    continue
+                if status == 429 or status >= 500:
+                    each.overload()
+                else:
+                    each.success(latency)
+        return status, text, auth
+
+    @asynccontextmanager
+    async def __slot(self):
+        """Hold one of the in-flight slots, whose number follows the adaptive limit.
+        Waits while a half-open probe is in flight.
+        """
+        async with self.slot_changed:
+            await self.slot_changed.wait_for(
+                lambda: self.in_flight < self.limiter.limit and self.breaker.state != CircuitBreaker.HALF_OPEN)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self.slot_changed:
+                self.in_flight -= 1
+                self.slot_changed.notify_all()
+
+    @staticmethod
+    def __unauthorized(status: int, text: str) -> bool:
+        """Check whether web rejected the authorization.
+        """
+        if status == 401:
+            return True
+        try:
+            return json.loads(text).get("code") == 401
+        except Exception:
+            return False
+
+    async def list_files(self, page: int, orderby: str = "create_time") -> Tuple[List[dict], int]:
+        """Get one page of files from web, newest first.
+
+        :param page: page number from 1
+        :param orderby: "create_time" or "update_time"
+        :return: docs of the page and total number of docs
+        """
+        # set max page size to 100
+        url = self.url_base + "document/list?kb_id=" + self.kb_id + f"&keywords=&page={page}&page_size=100&orderby={orderby}&desc=true"
+
+        text = await self.__send("GET", url)
+        try:
+            data = json.loads(text).get("data")
+            return data.get("docs"), data.get("total")
+        except Exception:
+            logger.debug("Response: %.500s", text)
+            raise
+
+    async def __read_file(self, file_path: str) -> AsyncIterator[bytes]:
+        """Read a file in chunks without blocking the event loop.
+        """
+        with open(file_path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, self.chunk_size):
+                if self.bucket:
+                    await self.bucket.consume_async(len(chunk))
+                yield chunk
+
+    def __encrypt_passwd(self) -> str:
+        """Encrypt password, only once.
+        """
+        if self.encrypted_password:
+            return self.encrypted_password
+        public_key = """-----BEGIN PUBLIC KEY-----
+MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEArq9XTUSeYr2+N1h3Afl/z8Dse/2yD0ZGrKwx+EEEcdsBLca9Ynmx3nIB5obmLlSfmskLpBo0UACBmB5rEjBp2Q2f3AG3Hjd4B+gNCG6BDaawuDlgANIhGnaTLrIqWrrcm4EMzJOnAOI1fgzJRsOOUEfaS318Eq9OVO3apEyCCt0lOQK6PuksduOjVxtltDav+guVAA068NrPYmRNabVKRNLJpL8w4D44sfth5RvZ3q9t+6RTArpEtc5sh5ChzvqPOzKGMXW83C95TxmXqpbK6olN4RevSfVjEAgCydH6HN6OhtOQEcnrU97r9H0iZOWwbw3pVrZiUkuRD1R56Wzs2wIDAQAB
+-----END PUBLIC KEY-----"""
+        self.encrypted_password = rsa_psw(self.password, public_key)
+        return self.encrypted_password
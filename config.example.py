@@ -16,10 +16,29 @@ FILE_SYSTEM_ROOT = ""  # root path of file system
 FILE_SYSTEM_SUFFIX = [
     ""
 ]  # suffixes of file path
+FILE_SYSTEM_LARGE_SIZE = 64 * 1024 * 1024  # files from this size on are uploaded alone, in bytes
+FILE_SYSTEM_MAX_SIZE = 0  # files above this size are oversized, in bytes, 0 for no limit
+FILE_SYSTEM_MAX_SIZE_POLICY = "skip"  # "skip" oversized files, or "defer" them after all other uploads
 
 # manager config
-MANAGER_PERIOD = 0  # period of manager in days
-MANAGER_PARSE_STRATEGY = ""  # parse strategy
+MANAGER_PERIOD = 0  # period of manager in days, 0 to sync every scan interval
+MANAGER_CRON = ""  # cron expression of syncs such as "0 2 * * *", overrides period
+MANAGER_WINDOWS = []  # time windows for bulk uploads and parsing such as ["22:00-06:00"], empty for any time
+MANAGER_PARSE_STRATEGY = ""  # parse strategy, "" to not parse, "immediate" or "offpeak" to parse within windows only
+MANAGER_PARSE_RETRIES = 3  # times a document whose parsing failed on web is parsed again before giving up
+MANAGER_SCAN_INTERVAL = 30  # interval of local scans between syncs, in seconds
+UPLOAD_RATE_LIMIT = 0  # max upload bandwidth in bytes per second, 0 for no limit
+
+# asyncio manager config, used with --asyncio
+ASYNC_CONCURRENCY = 8  # initial requests in flight, adapted to server load
+ASYNC_MAX_CONCURRENCY = 256  # max requests in flight
+ASYNC_BATCH_SIZE = 32  # initial files per upload request
+ASYNC_LARGE_CONCURRENCY = 2  # large file uploads at once
+ASYNC_CONNECTION_LIMIT = 0  # max open connections, 0 for max requests in flight plus large file uploads
+
+# log config
+LOG_LEVEL = "INFO"  # logging level, "DEBUG" logs every scanned file
+LOG_FILE = ""  # also log to this file, rotated at 10 MB, empty for console only
 
 # RAGFlow config
 RAGFLOW_URL = ""  # base url of ragflow
@@ -29,3 +48,4 @@ RAGFLOW_KNOWLEDGE_BASE_NAME = ""  # knowledge base name
 RAGFLOW_PARSER = ""  # parser name, including "General", "Manual", "Paper", etc.
 RAGFLOW_AUTHORIZATION = ""  # authorization string
 RAGFLOW_KNOWLEDGE_BASE_ID = ""  # knowledge base id
+RAGFLOW_FULL_LISTING_INTERVAL = 1  # days between full listings of the knowledge base, other syncs list changed documents only
@@ -9,8 +9,10 @@ Version: 0.1.0
 
 import os
 import time
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
 from utils.wwhash import calculate_file_hash
+from filesystem.wwindex import FileIndex
+from filesystem.wwremote import RemoteSnapshot
 from utils.wwsqlite import SQLiteDB
 from utils.wwlog import logger
 
@@ -18,10 +20,23 @@ from utils.wwlog import logger
 class FileSystem:
     """A manager to maintain root file system.
     """
-    def __init__(self, root_dir: str, suffix: List[str]):
+    def __init__(self, root_dir: str, suffix: List[str], large_file_size: int = 64 * 1024 * 1024, max_file_size: int = 0,
+                 max_size_policy: str = "skip", full_listing_interval: float = 1):
+        """
+        :param large_file_size: files from this size on are uploaded alone in the large file lane
+        :param max_file_size: files above this size are oversized, 0 for no limit
+        :param max_size_policy: "skip" oversized files, or "defer" them after all other uploads
+        :param full_listing_interval: days between full listings of web in the remote snapshot
+        """
+        if max_size_policy not in ("skip", "defer"):
+            raise ValueError(f"Unknown max size policy {max_size_policy}.")
         self.root_dir = root_dir
         self.suffix = suffix
+        self.large_file_size = large_file_size
+        self.max_file_size = max_file_size
+        self.max_size_policy = max_size_policy
         self.db = SQLiteDB()
+        self.remote = RemoteSnapshot(self.db, full_listing_interval)
         
     def check_db(self) -> None:
         """Check database and initialize it if not initialized.
@@ -40,6 +55,19 @@ class FileSystem:
             
             UNIQUE(path)
         """)
+        # columns added later, migrate databases created before them
+        columns = [row[1] for row in self.db.fetch_all("PRAGMA table_info(ragflow)")]
+        for column, definition in (("size", "INTEGER DEFAULT NULL"), ("mtime", "INTEGER DEFAULT NULL"),
+                                   ("reason", "TEXT DEFAULT NULL"), ("failures", "INTEGER DEFAULT 0")):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE ragflow ADD COLUMN {column} {definition}")
+        # changed files used to get status 2, which nothing picks up, stage them as update
+        self.db.execute("UPDATE ragflow SET status = CASE WHEN doc_id IS NULL THEN 0 ELSE 1 END WHERE status = 2")
+        self.db.create_table("meta", """
+            key TEXT PRIMARY KEY,
+            value TEXT
+        """)
+        self.remote.check_table()
         logger.debug("Database successfully initialized.")
 
     def scan_database(self) -> List[str]:
@@ -54,16 +82,17 @@ class FileSystem:
 
         for path, status, doc_id in ret:
             if not os.path.exists(path):
-                logger.debug(f"File {path} not found, deleting from database.")
-                self.db.delete("ragflow", "path =?", (path,))
-                if not doc_id:
-                    # it won't happen, maybe
-                    logger.critical(f"File {path} has no doc_id, failed to delete it.")
+                logger.debug("File %s not found, status %s.", path, status, limit=True)
+                if status == 0 or not doc_id:
+                    if status != 0:
+                        # it won't happen, maybe
+                        logger.critical("File %s has no doc_id, failed to delete it.", path)
+                    # not on web, deleting from database only
+                    self.db.delete("ragflow", "path =?", (path,))
                     continue
-                logger.debug(f"Deleting file status {status}.")
-                if status not in (0, 1):
-                    logger.debug(f"File {path} not found, deleting from web.")
-                    removed_files.append(doc_id)
+                # keep the record until web confirms deletion, see remove_files
+                logger.debug("File %s not found, deleting from web.", path, limit=True)
+                removed_files.append(doc_id)
         
         logger.debug("Scanning completed.")
         return removed_files
@@ -75,43 +104,87 @@ class FileSystem:
         """
         logger.debug("Scanning root directory...")
 
-        for dir_path, dir_names, filenames in os.walk(self.root_dir):
-            # skip hidden directories
-            dir_names[:] = [d for d in dir_names if not d.startswith(".")]
-
-            for filename in filenames:
-                file_extension = os.path.splitext(filename)[1]
-                if file_extension not in self.suffix:
-                    logger.debug(f"File {filename} has unsupported extension {file_extension}, skipping.")
+        # look files up in memory, write changes back at the end
+        index = FileIndex(self.root_dir)
+        index.load(self.db)
+        for file_path, relative_filename, file_extension in self.__walk():
+            stat = os.stat(file_path)
+
+            # search file_path in the index
+            if record := index.get(file_path):
+                # file already in the database
+                if (stat.st_size, stat.st_mtime_ns) == (record.size, record.mtime):
+                    # size and modification time unchanged, skip hashing
+                    logger.debug("File %s already up-to-date.", file_path, limit=True)
                     continue
-
-                file_path = os.path.join(dir_path, filename)
                 hash_value = calculate_file_hash(file_path)
-
-                # search file_path in the database
-                if ret := self.db.fetch_one("SELECT hash, status FROM ragflow WHERE path = ?", (file_path,)):
-                    # file already in the database
-                    if hash_value == ret[0]:
-                        # no need to update
-                        logger.debug(f"File {file_path} already up-to-date.")
-                        continue
-                    else:
-                        # file was changed, update file status to 2
-                        if ret[1] == 1:  # if old file not upload, nothing needs to do
-                            # this may not happen
-                            logger.debug(f"File {file_path} changed, but staged only.")
-                        else:
-                            logger.debug(f"File {file_path} changed, updating.")
-                            self.db.update("ragflow", f"hash = ?, status = ?", "path = ?", (hash_value, 2, file_path))
+                # hashes are not kept in the index, changed files are few
+                if hash_value == self.db.fetch_one("SELECT hash FROM ragflow WHERE path = ?", (file_path,))[0]:
+                    # no need to update, only remember size and modification time
+                    logger.debug("File %s already up-to-date.", file_path, limit=True)
+                    index.touch(file_path, record, stat.st_size, stat.st_mtime_ns)
+                    continue
                 else:
-                    # file not in the database, insert it
-                    relative_path = os.path.relpath(dir_path, self.root_dir)
-                    relative_filename = os.path.join(relative_path, filename)
-                    self.db.insert("ragflow", "path, filename, extension, hash, status",
-                                   (file_path, relative_filename, file_extension, hash_value, 0))
+                    if record.status in (0, 1):
+                        # not uploaded yet, or already staged as update, keep the status
+                        logger.debug("File %s changed, but staged only.", file_path, limit=True)
+                        index.change(file_path, record, hash_value, record.status, stat.st_size, stat.st_mtime_ns)
+                    else:
+                        # file was changed on web, stage it as update
+                        logger.debug("File %s changed, updating.", file_path, limit=True)
+                        index.change(file_path, record, hash_value, 1, stat.st_size, stat.st_mtime_ns)
+            else:
+                # file not in the database, insert it
+                hash_value = calculate_file_hash(file_path)
+                index.insert(file_path, relative_filename, file_extension, hash_value, stat.st_size, stat.st_mtime_ns)
 
+        index.flush(self.db)
         logger.debug("Scanning completed.")
 
+    def rebuild(self, remote_docs: Iterable[dict]) -> Tuple[int, int, int]:
+        """Rebuild the database from the root directory and the documents on web, without uploading.
+
+        Local files are matched to documents by relative filename, and by size where web tells it.
+        Matched files keep their doc_id, a size mismatch is staged as update, unmatched files are new.
+
+        :param remote_docs: documents listed from web
+        :return: numbers of matched, staged and new files
+        """
+        logger.info("Rebuilding database from web...")
+
+        remote = {}
+        for doc in remote_docs:
+            if doc.get("name") in remote:
+                logger.warning("Duplicate document %s on web, keeping the first one.", doc.get('name'))
+                continue
+            remote[doc.get("name")] = doc
+
+        rows = []
+        matched = staged = 0
+        for file_path, relative_filename, file_extension in self.__walk():
+            stat = os.stat(file_path)
+            hash_value = calculate_file_hash(file_path)
+            status, doc_id = 0, None
+            if doc := remote.pop(relative_filename, None):
+                doc_id = doc.get("id")
+                if doc.get("size") is not None and doc.get("size") != stat.st_size:
+                    # changed since uploaded, stage it as update
+                    status = 1
+                    staged += 1
+                else:
+                    # run "1" running and "3" done are not started again,
+                    # "0" unstarted, "2" cancelled and "4" failed are queued for parsing
+                    status = 4 if str(doc.get("run")) in ("1", "3") else 3
+                    matched += 1
+            rows.append((file_path, relative_filename, file_extension, hash_value, status, doc_id, stat.st_size, stat.st_mtime_ns))
+
+        # replace the whole table in one transaction
+        self.db.replace_all("ragflow", "path, filename, extension, hash, status, doc_id, size, mtime", rows)
+        if remote:
+            logger.warning("%s documents on web have no local file, left untouched.", len(remote))
+        logger.info("Database rebuilt, %s matched, %s staged as update, %s new.", matched, staged, len(rows) - matched - staged)
+        return matched, staged, len(rows) - matched - staged
+
     def update_files(self) -> List[str]:
         """Update files in the database.
 
@@ -121,26 +194,71 @@ class FileSystem:
         self.scan_files()
         return removed_files
 
-    def get_new_files(self) -> List[Tuple[str, str]]:
+    def remove_files(self, file_ids: List[str]) -> None:
+        """Delete records of files removed from web.
+
+        :param file_ids: doc ids of removed files
+        :return: None
+        """
+        self.db.execute_many([("DELETE FROM ragflow WHERE doc_id = ?", [(file_id,) for file_id in file_ids])])
+
+    def get_new_files(self) -> List[Tuple[str, str, int]]:
         """Get new files.
 
-        :return: list of new files
+        :return: list of new files, with their sizes
         """
-        return [(row[0], row[1]) for row in self.db.fetch_all("SELECT path, filename FROM ragflow WHERE status = 0")]
+        return [(row[0], row[1], row[2] or 0) for row in self.db.fetch_all("SELECT path, filename, size FROM ragflow WHERE status = 0")]
         
-    def get_updated_files(self) -> List[Tuple[str, str, str]]:
+    def get_updated_files(self) -> List[Tuple[str, str, str, int]]:
         """Get updated files.
 
-        :return: list of updated files
+        :return: list of updated files, with their sizes
+        """
+        return [(row[0], row[1], row[2], row[3] or 0)
+                for row in self.db.fetch_all("SELECT doc_id, path, filename, size FROM ragflow WHERE status = 1")]
+
+    def split_by_size(self, files: List[Tuple]) -> Tuple[List[Tuple], List[Tuple]]:
+        """Split files into small and large ones by size, oversized files follow max_size_policy.
+
+        :param files: file tuples, ending with path, filename and size
+        :return: small files for batched uploads, and large files for the large file lane
+        """
+        small_files, large_files, oversized_files = [], [], []
+        for file in files:
+            size = file[-1]
+            if self.max_file_size and size > self.max_file_size:
+                oversized_files.append(file)
+            elif size >= self.large_file_size:
+                large_files.append(file)
+            else:
+                small_files.append(file)
+
+        reasons = []
+        for file in oversized_files:
+            reason = f"{self.max_size_policy}: size {file[-1]} exceeds max size {self.max_file_size}"
+            logger.debug("File %s oversized, %s.", file, reason, limit=True)
+            reasons.append((file[-3], reason))
+        if reasons:
+            self.set_files_reason(reasons)
+        if self.max_size_policy == "defer":
+            large_files.extend(oversized_files)
+        return small_files, large_files
+
+    def set_files_reason(self, reasons: List[Tuple[str, Optional[str]]]) -> None:
+        """Set the reasons files are held back, writing only reasons that changed.
+
+        :param reasons: file paths and reasons, None to clear a reason
+        :return: None
         """
-        return [(row[0], row[1], row[2]) for row in self.db.fetch_all("SELECT doc_id, path, filename FROM ragflow WHERE status = 1")]
+        self.db.execute_many([("UPDATE ragflow SET reason = ? WHERE path = ? AND reason IS NOT ?",
+                               [(reason, file_path, reason) for file_path, reason in reasons])])
 
-    def get_unprocessed_files(self) -> List[str]:
+    def get_unprocessed_files(self) -> List[Tuple[str, str]]:
         """Get unprocessed files.
 
-        :return: list of unprocessed files
+        :return: list of unprocessed files, with their doc ids
         """
-        return [row[0] for row in self.db.fetch_all("SELECT path FROM ragflow WHERE status = 3")]
+        return [(row[0], row[1]) for row in self.db.fetch_all("SELECT path, doc_id FROM ragflow WHERE status = 3 AND doc_id IS NOT NULL")]
 
     def set_file_id(self, file_path: str, file_id: str) -> None:
         """Set file id.
@@ -169,8 +287,78 @@ class FileSystem:
          0 = unuploaded and new, 1 = unuploaded but update, 2 = uploaded but not processed, 3 = uploaded and processing, 4 = uploaded and processed
         :return: None
         """
-        for file_path in file_paths:
-            self.db.update("ragflow", "status =?", "path =?", (status, file_path))
+        self.db.execute_many([("UPDATE ragflow SET status = ? WHERE path = ?", [(status, file_path) for file_path in file_paths])])
+
+    def set_files_uploaded(self, files: List[Tuple[str, str]]) -> None:
+        """Set files uploaded, status 3 with their new doc ids.
+
+        :param files: paths and doc ids of files
+        :return: None
+        """
+        self.db.execute_many([("UPDATE ragflow SET status = 3, doc_id = ?, reason = NULL WHERE path = ?",
+                               [(file_id, file_path) for file_path, file_id in files])])
+
+    def reset_files(self, file_paths: List[str]) -> None:
+        """Set files whose document was deleted from web as new, status 0 without doc id.
+
+        :param file_paths: file paths
+        :return: None
+        """
+        self.db.execute_many([("UPDATE ragflow SET status = 0, doc_id = NULL, reason = NULL, failures = 0 WHERE path = ?",
+                               [(file_path,) for file_path in file_paths])])
+
+    def set_parse_failed(self, file_paths: List[str], max_retries: int) -> int:
+        """Count a failed parsing of files on web, and queue them for parsing again up to max_retries times.
+
+        :param file_paths: file paths
+        :param max_retries: max times a file is parsed again
+        :return: number of files queued again
+        """
+        self.db.execute_many([
+            ("UPDATE ragflow SET failures = failures + 1 WHERE path = ?", [(file_path,) for file_path in file_paths]),
+            ("UPDATE ragflow SET status = 3 WHERE path = ? AND failures <= ?", [(file_path, max_retries) for file_path in file_paths]),
+            # given up files keep status 4 until their content changes
+            ("UPDATE ragflow SET reason = ? WHERE path = ? AND failures > ?",
+             [(f"parsing failed on web {max_retries + 1} times", file_path, max_retries) for file_path in file_paths])
+        ])
+        return self.db.fetch_one(f"SELECT COUNT(*) FROM ragflow WHERE status = 3 AND path IN ({', '.join(['?'] * len(file_paths))})",
+                                 tuple(file_paths))[0]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        """Get a value from meta table.
+
+        :param key: meta key
+        :return: meta value, or None if not set
+        """
+        ret = self.db.fetch_one("SELECT value FROM meta WHERE key = ?", (key,))
+        return ret[0] if ret else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        """Set a value in meta table.
+
+        :param key: meta key
+        :param value: meta value
+        :return: None
+        """
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def __walk(self) -> Iterator[Tuple[str, str, str]]:
+        """Walk the root directory, skipping hidden directories and unsupported extensions.
+
+        :return: iterator of file path, relative filename and extension
+        """
+        for dir_path, dir_names, filenames in os.walk(self.root_dir):
+            # skip hidden directories
+            dir_names[:] = [d for d in dir_names if not d.startswith(".")]
+
+            for filename in filenames:
+                file_extension = os.path.splitext(filename)[1]
+                if file_extension not in self.suffix:
+                    logger.debug("File %s has unsupported extension %s, skipping.", filename, file_extension, limit=True)
+                    continue
+
+                relative_path = os.path.relpath(dir_path, self.root_dir)
+                yield os.path.join(dir_path, filename), os.path.join(relative_path, filename), file_extension
 
     def connect(self) -> None:
         """Connect to the database.
@@ -0,0 +1,97 @@
+"""
+Module File: wwindex.py
+Description: This module contains the in-memory snapshot index of the ragflow table, used by file scans.
+
+Author: Icingworld
+Date: 2025-04-05
+Version: 0.1.0
+"""
+
+import sys
+from typing import Dict, List, Optional, Tuple
+from utils.wwsqlite import SQLiteDB
+
+
+class FileRecord:
+    """Scan state of one tracked file.
+
+    Hashes are left out, they are only needed when size or modification time changed,
+    and are fetched from the database then.
+    """
+    __slots__ = ("status", "size", "mtime")
+
+    def __init__(self, status: int, size: Optional[int], mtime: Optional[int]):
+        self.status = status
+        self.size = size
+        self.mtime = mtime
+
+
+class FileIndex:
+    """Snapshot of the ragflow table under one root directory, keyed by interned relative path.
+
+    Loaded once per scan, lookups are dict lookups, and changes are collected here
+    and written back in one transaction by flush.
+    About 280 bytes per tracked file on CPython 3, so 1 million files take about 280 MB.
+    """
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self.records: Dict[str, FileRecord] = {}
+        self.inserts: List[Tuple] = []  # path, filename, extension, hash, status, size, mtime
+        self.changes: List[Tuple] = []  # hash, status, size, mtime, path
+        self.touches: List[Tuple] = []  # size, mtime, path
+
+    def load(self, db: SQLiteDB) -> None:
+        """Load records of files under the root directory.
+
+        :param db: database
+        :return: None
+        """
+        prefix = len(self.root_dir)
+        self.records = {sys.intern(path[prefix:]): FileRecord(status, size, mtime)
+                        for path, status, size, mtime in db.fetch_all("SELECT path, status, size, mtime FROM ragflow")
+                        if path.startswith(self.root_dir)}
+
+    def get(self, file_path: str) -> Optional[FileRecord]:
+        """Get the record of a file.
+
+        :param file_path: file path under the root directory
+        :return: record, or None if not tracked
+        """
+        return self.records.get(file_path[len(self.root_dir):])
+
+    def insert(self, file_path: str, relative_filename: str, file_extension: str, hash_value: str, size: int, mtime: int) -> None:
+        """Track a new file.
+
+        :return: None
+        """
+        self.records[sys.intern(file_path[len(self.root_dir):])] = FileRecord(0, size, mtime)
+        self.inserts.append((file_path, relative_filename, file_extension, hash_value, 0, size, mtime))
+
+    def change(self, file_path: str, record: FileRecord, hash_value: str, status: int, size: int, mtime: int) -> None:
+        """Record new content of a file.
+
+        :return: None
+        """
+        record.status, record.size, record.mtime = status, size, mtime
+        self.changes.append((hash_value, status, size, mtime, file_path))
+
+    def touch(self, file_path: str, record: FileRecord, size: int, mtime: int) -> None:
+        """Record new size and modification time of a file with the same content.
+
+        :return: None
+        """
+        record.size, record.mtime = size, mtime
+        self.touches.append((size, mtime, file_path))
+
+    def flush(self, db: SQLiteDB) -> None:
+        """Write collected changes back in one transaction.
+
+        :param db: database
+        :return: None
+        """
+        db.execute_many([
+            ("INSERT INTO ragflow (path, filename, extension, hash, status, size, mtime) VALUES (?, ?, ?, ?, ?, ?, ?)", self.inserts),
+            ("UPDATE ragflow SET hash = ?, status = ?, size = ?, mtime = ?, reason = NULL, failures = 0 WHERE path = ?", self.changes),
+            ("UPDATE ragflow SET size = ?, mtime = ? WHERE path = ?", self.touches)
+        ])
+        self.inserts, self.changes, self.touches = [], [], []
@@ -0,0 +1,140 @@
+"""
+Module File: wwremote.py
+Description: This module contains the cached snapshot of documents on web, used to detect drift from local state.
+
+Author: Icingworld
+Date: 2025-04-06
+Version: 0.1.0
+"""
+
+import time
+from typing import Iterable, List, Optional, Tuple
+from utils.wwsqlite import SQLiteDB
+
+
+# run status of documents on web
+RUN_DONE = "3"
+RUN_FAIL = "4"
+
+
+class RemoteSnapshot:
+    """Snapshot of the web listing (id, name, size, run status, update time) kept in the remote table.
+
+    Web lists documents by update time, newest first, so a refresh only needs the pages
+    down to the newest update time already in the snapshot. Deletions don't show up
+    in those pages, they are noticed by the total count and fixed by a full listing,
+    which goes by create time since update times change while parsing.
+    """
+    def __init__(self, db: SQLiteDB, full_listing_interval: float = 1):
+        """
+        :param full_listing_interval: days between full listings, which also catch deletions the count misses
+        """
+        self.db = db
+        self.full_listing_interval = full_listing_interval * 24 * 60 * 60
+
+    def check_table(self) -> None:
+        """Create the remote table if not created.
+
+        :return: None
+        """
+        self.db.create_table("remote", """
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            size INTEGER DEFAULT NULL,
+            run TEXT DEFAULT NULL,
+            update_time INTEGER DEFAULT NULL
+        """)
+
+    @property
+    def watermark(self) -> Optional[int]:
+        """Newest update time in the snapshot, None if never listed.
+        """
+        if not self.db.fetch_one("SELECT value FROM meta WHERE key = 'remote_listed_at'"):
+            return None
+        return self.db.fetch_one("SELECT MAX(update_time) FROM remote")[0] or 0
+
+    def count(self) -> int:
+        """Get the number of documents in the snapshot.
+
+        :return: number of documents
+        """
+        return self.db.fetch_one("SELECT COUNT(*) FROM remote")[0]
+
+    def needs_full_listing(self) -> bool:
+        """Check whether the snapshot must be rebuilt from a full listing.
+
+        :return: True if never listed or listed too long ago
+        """
+        listed_at = self.db.fetch_one("SELECT value FROM meta WHERE key = 'remote_listed_at'")
+        return not listed_at or time.time() - float(listed_at[0]) >= self.full_listing_interval
+
+    def is_caught_up(self, docs: List[dict]) -> bool:
+        """Check whether a page listed newest first reaches the snapshot, so older pages are known.
+
+        :param docs: documents of the page
+        :return: True if no more pages are needed
+        """
+        return not docs or (docs[-1].get("update_time") or 0) < self.watermark
+
+    def apply(self, docs: Iterable[dict]) -> None:
+        """Insert or update changed documents.
+
+        :param docs: documents listed from web
+        :return: None
+        """
+        self.db.execute_many([("INSERT OR REPLACE INTO remote (id, name, size, run, update_time) VALUES (?, ?, ?, ?, ?)",
+                               [self.__row(doc) for doc in docs])])
+
+    def replace(self, docs: Iterable[dict]) -> None:
+        """Replace the snapshot with a full listing.
+
+        :param docs: all documents listed from web
+        :return: None
+        """
+        self.db.replace_all("remote", "id, name, size, run, update_time", [self.__row(doc) for doc in docs])
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('remote_listed_at', ?)", (str(time.time()),))
+
+    def remove(self, doc_ids: List[str]) -> None:
+        """Remove documents deleted from web by us, so the count stays right.
+
+        :param doc_ids: doc ids
+        :return: None
+        """
+        self.db.execute_many([("DELETE FROM remote WHERE id = ?", [(doc_id,) for doc_id in doc_ids])])
+
+    def find_drift(self, max_parse_retries: int = 3) -> Tuple[List[str], List[str], List[str], List[str]]:
+        """Compare the snapshot with local state.
+
+        :param max_parse_retries: files whose parsing failed more often are given up and not reported
+        :return: paths of files whose document is missing on web, paths of parsed files whose parsing failed on web,
+         paths of files parsed on web but not marked so, and doc ids of duplicates of local file names to delete
+        """
+        missing = [row[0] for row in self.db.fetch_all(
+            "SELECT path FROM ragflow WHERE status IN (1, 3, 4) AND doc_id IS NOT NULL "
+            "AND doc_id NOT IN (SELECT id FROM remote)")]
+        failed = [row[0] for row in self.db.fetch_all(
+            "SELECT r.path FROM ragflow r JOIN remote d ON r.doc_id = d.id WHERE r.status = 4 AND d.run = ? AND r.failures <= ?",
+            (RUN_FAIL, max_parse_retries))]
+        parsed = [row[0] for row in self.db.fetch_all(
+            "SELECT r.path FROM ragflow r JOIN remote d ON r.doc_id = d.id WHERE r.status = 3 AND d.run = ?", (RUN_DONE,))]
+
+        # of documents sharing a name keep the one a local file points to, else the newest,
+        # names of no local file belong to documents uploaded in the UI and are left alone
+        duplicates, kept = [], set()
+        for doc_id, name, _, _ in self.db.fetch_all(
+                "SELECT d.id, d.name, r.path IS NOT NULL AS referenced, d.update_time FROM remote d "
+                "LEFT JOIN ragflow r ON r.doc_id = d.id "
+                "WHERE d.name IN (SELECT name FROM remote GROUP BY name HAVING COUNT(*) > 1) "
+                "AND d.name IN (SELECT filename FROM ragflow) "
+                "ORDER BY d.name, referenced DESC, d.update_time DESC"):
+            if name in kept:
+                duplicates.append(doc_id)
+            else:
+                kept.add(name)
+        return missing, failed, parsed, duplicates
+
+    @staticmethod
+    def __row(doc: dict) -> Tuple:
+        """Get the remote table row of a document.
+        """
+        return doc.get("id"), doc.get("name"), doc.get("size"), str(doc.get("run")), doc.get("update_time")
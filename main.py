@@ -1,13 +1,54 @@
+import argparse
 from manager.wwmanager import Manager
-from config import *
+from utils.wwlog import logger
+import config
 
 if __name__ == "__main__":
-    manager = Manager(
-        FILE_SYSTEM_ROOT,
-        FILE_SYSTEM_SUFFIX,
-        RAGFLOW_URL,
-        RAGFLOW_EMAIL,
-        RAGFOW_PASSWORD,
-        RAGFLOW_KNOWLEDGE_BASE_ID
+    parser = argparse.ArgumentParser(description = "RAGFlow knowledge base file manager.")
+    parser.add_argument("--asyncio", action = "store_true", help = "run the asyncio based manager")
+    parser.add_argument("--once", action = "store_true", help = "run a single cycle and exit, for cron or timers")
+    parser.add_argument("--bootstrap", action = "store_true",
+                        help = "rebuild local state from the knowledge base before running, instead of uploading everything")
+    args = parser.parse_args()
+
+    logger.configure(getattr(config, "LOG_LEVEL", "DEBUG"), getattr(config, "LOG_FILE", "") or None)
+
+    settings = (
+        config.FILE_SYSTEM_ROOT,
+        config.FILE_SYSTEM_SUFFIX,
+        config.RAGFLOW_URL,
+        config.RAGFLOW_EMAIL,
+        config.RAGFOW_PASSWORD,
+        config.RAGFLOW_KNOWLEDGE_BASE_ID
     )
-    manager.run()
+    # optional settings, older config files may not have them
+    options = {
+        "large_file_size": getattr(config, "FILE_SYSTEM_LARGE_SIZE", 64 * 1024 * 1024),
+        "max_file_size": getattr(config, "FILE_SYSTEM_MAX_SIZE", 0),
+        "max_size_policy": getattr(config, "FILE_SYSTEM_MAX_SIZE_POLICY", "skip"),
+        "period": getattr(config, "MANAGER_PERIOD", 1),
+        "cron": getattr(config, "MANAGER_CRON", ""),
+        "windows": getattr(config, "MANAGER_WINDOWS", []),
+        "parse_strategy": getattr(config, "MANAGER_PARSE_STRATEGY", ""),
+        "scan_interval": getattr(config, "MANAGER_SCAN_INTERVAL", 30),
+        "upload_rate": getattr(config, "UPLOAD_RATE_LIMIT", 0),
+        "full_listing_interval": getattr(config, "RAGFLOW_FULL_LISTING_INTERVAL", 1),
+        "max_parse_retries": getattr(config, "MANAGER_PARSE_RETRIES", 3)
+    }
+
+    # bootstrap is a one-off, the blocking manager streams the listing
+    if args.bootstrap and not Manager(*settings, **options).bootstrap():
+        exit(1)
+
+    if args.asyncio:
+        from manager.wwasyncmanager import AsyncManager as Manager
+        options.update({
+            "concurrency": getattr(config, "ASYNC_CONCURRENCY", 8),
+            "max_concurrency": getattr(config, "ASYNC_MAX_CONCURRENCY", 256),
+            "batch_size": getattr(config, "ASYNC_BATCH_SIZE", 32),
+            "large_concurrency": getattr(config, "ASYNC_LARGE_CONCURRENCY", 2),
+            "connection_limit": getattr(config, "ASYNC_CONNECTION_LIMIT", 0)
+        })
+
+    manager = Manager(*settings, **options)
+    manager.run(once = args.once)
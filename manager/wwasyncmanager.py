@@ -0,0 +1,323 @@
+"""
+Module File: wwasyncmanager.py
+Description: This module contains asynchronous manager of RAGFlow knowledge base files.
+
+Author: Icingworld
+Date: 2025-03-24
+Version: 0.1.0
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+from filesystem.wwfilesystem import FileSystem
+from api.wwasyncapi import AsyncWebApi
+from utils.wwlog import logger
+from utils.wwschedule import Scheduler
+from utils.wwcontrol import CircuitBreaker
+
+
+class AsyncManager:
+    """Asynchronous manager of RAGFlow knowledge base files.
+
+    Local scanning runs in a dedicated worker thread (sqlite connections are bound to
+    the thread that created them), so it overlaps with network I/O on the event loop.
+    """
+    def __init__(self, root_path: str, suffixes: List[str], url_base: str, email: str, password: str, kb_id: str, period: float = 1,
+                 large_file_size: int = 64 * 1024 * 1024, max_file_size: int = 0, max_size_policy: str = "skip",
+                 batch_bytes: int = 32 * 1024 * 1024, large_timeout: float = 600.0, cron: str = "",
+                 windows: Optional[List[str]] = None, parse_strategy: str = "", scan_interval: float = 30, upload_rate: float = 0,
+                 full_listing_interval: float = 1, max_parse_retries: int = 3,
+                 concurrency: int = 8, batch_size: int = 32, large_concurrency: int = 2, max_concurrency: int = 256,
+                 connection_limit: int = 0):
+        if parse_strategy not in ("", "immediate", "offpeak"):
+            raise ValueError(f"Unknown parse strategy {parse_strategy}.")
+        self.root_path = root_path
+        self.suffixes = suffixes
+        self.file_system_options = (large_file_size, max_file_size, max_size_policy, full_listing_interval)
+        self.api = AsyncWebApi(url_base, email, password, kb_id, concurrency, batch_size,
+                               large_concurrency = large_concurrency, large_timeout = large_timeout, upload_rate = upload_rate,
+                               max_concurrency = max_concurrency, connection_limit = connection_limit)
+        self.period = period
+        self.batch_bytes = batch_bytes  # max total size of an upload batch
+        self.scheduler = Scheduler(period, cron, windows, scan_interval)
+        self.parse_strategy = parse_strategy
+        self.scan_interval = scan_interval
+        self.max_parse_retries = max_parse_retries
+        self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "filesystem")
+        self.file_system = None
+
+    def run(self, once: bool = False) -> None:
+        """Run manager cycles.
+
+        :param once: run a single cycle and return
+        :return: None
+        """
+        asyncio.run(self.run_async(once))
+
+    async def run_async(self, once: bool = False) -> None:
+        # file system must be created in its worker thread
+        self.file_system = await self.__fs(FileSystem, self.root_path, self.suffixes, *self.file_system_options)
+
+        async with self.api:
+            next_sync = datetime.now()
+            while True:
+                now = datetime.now()
+                if now >= next_sync:
+                    if await self.run_once(self.scheduler.in_window(now)):
+                        next_sync = self.scheduler.next_run(datetime.now())
+                    else:
+                        # deferred outside of windows, or server down, retry after a scan interval at least
+                        next_sync = self.scheduler.next_retry(datetime.now())
+                    logger.info("Next sync at %s.", next_sync)
+                    # next sync is a scan interval away at least
+                    wait = self.scan_interval
+                else:
+                    await self.scan_once()
+                    # wake up for the next scan, or the next sync if it comes first
+                    wait = min(self.scan_interval, (next_sync - datetime.now()).total_seconds())
+                if once:
+                    return
+
+                await asyncio.sleep(max(0.0, wait))
+
+    async def scan_once(self) -> None:
+        """Scan local files only, without network work.
+
+        :return: None
+        """
+        await self.__fs(self.file_system.connect)
+        await self.__fs(self.file_system.check_db)
+        await self.__fs(self.file_system.scan_files)
+        await self.__fs(self.file_system.disconnect)
+
+    async def run_once(self, bulk: bool = True) -> bool:
+        """Run a single manager cycle.
+
+        :param bulk: do bulk upload and parse work, False outside of windows
+        :return: True if the cycle was done with bulk work and its web calls succeeded
+        """
+        # connect to file system
+        await self.__fs(self.file_system.connect)
+
+        # check database and initialize it if not initialized
+        await self.__fs(self.file_system.check_db)
+
+        # server is down, keep scanning locally and defer network work to the next cycle
+        if self.api.breaker.is_open():
+            logger.warning("RAGFlow unavailable, network work deferred.")
+            await self.__fs(self.file_system.scan_files)
+            await self.__fs(self.file_system.disconnect)
+            return False
+
+        # reuse cached authorization, login only if there is none
+        if not self.api.headers["Authorization"]:
+            self.api.headers["Authorization"] = await self.__fs(self.file_system.get_meta, "authorization") or ""
+        if not await self.api.ensure_login():
+            logger.error("Login failed, retry in next cycle.")
+            await self.__fs(self.file_system.disconnect)
+            return False
+
+        # failed web calls make the cycle retried soon instead of at the next scheduled sync
+        done = True
+
+        # delete removed files on web while scanning the root directory
+        delete_task = None
+        if to_be_deleted := await self.__fs(self.file_system.scan_database):
+            delete_task = asyncio.create_task(self.api.delete_files(to_be_deleted))
+        await self.__fs(self.file_system.scan_files)
+        # records are kept for next cycle if deletion fails
+        if delete_task:
+            if await delete_task:
+                await self.__fs(self.file_system.remove_files, to_be_deleted)
+                await self.__fs(self.file_system.remote.remove, to_be_deleted)
+            else:
+                done = False
+
+        if bulk:
+            # delete old documents of updated files, then upload them with new files
+            # together, so deferred files go after all of them
+            updated = await self.__update_files(await self.__fs(self.file_system.get_updated_files))
+            uploaded, complete = await self.__upload(await self.__fs(self.file_system.get_new_files))
+            done = updated and complete
+        else:
+            uploaded = []
+            logger.info("Outside of upload windows, uploads deferred.")
+
+        # list documents changed on web, including the ones just uploaded
+        if (remote_docs := await self.__refresh_remote()) is not None:
+            if uploaded:
+                await self.__record_uploaded(uploaded, remote_docs)
+            await self.__reconcile()
+        else:
+            done = False
+
+        # start to parse files, including the ones whose parsing failed on web
+        if self.parse_strategy == "immediate" or (self.parse_strategy == "offpeak" and bulk):
+            if to_be_parsed := await self.__fs(self.file_system.get_unprocessed_files):
+                await self.__parse(to_be_parsed)
+
+        # save authorization if it was renewed
+        if self.api.headers["Authorization"] != await self.__fs(self.file_system.get_meta, "authorization"):
+            await self.__fs(self.file_system.set_meta, "authorization", self.api.headers["Authorization"])
+
+        # a circuit not closed means some calls failed, and only a retry lets it probe the server
+        if self.api.breaker.state != CircuitBreaker.CLOSED:
+            done = False
+        if bulk and not done:
+            logger.warning("Sync incomplete, retry after the next scan.")
+
+        # disconnect from file system
+        await self.__fs(self.file_system.disconnect)
+        return bulk and done
+
+    async def __record_uploaded(self, files: List[Tuple[str, str]], remote_docs: List[dict]) -> None:
+        """Read doc ids of uploaded files from the listing and set their status to 3.
+
+        :param files: paths and names of uploaded files
+        :param remote_docs: documents listed from web, newest first
+        """
+        web_file_ids = {}
+        for doc in remote_docs:
+            # newest document of a name is the one just uploaded
+            web_file_ids.setdefault(doc.get("name"), doc.get("id"))
+        await self.__fs(self.file_system.set_files_uploaded, [(file_path, web_file_ids[file_name])
+                                                              for file_path, file_name in files if file_name in web_file_ids])
+
+    async def __refresh_remote(self) -> Optional[List[dict]]:
+        """Bring the remote snapshot up to date, listing only documents changed since the last refresh when possible.
+
+        :return: documents listed, newest first, or None if listing failed
+        """
+        remote = self.file_system.remote
+        try:
+            if not await self.__fs(remote.needs_full_listing):
+                changed, page = [], 1
+                while True:
+                    docs, total = await self.api.list_files(page, "update_time")
+                    changed += docs
+                    if await self.__fs(remote.is_caught_up, docs) or page * 100 >= total:
+                        break
+                    page += 1
+                await self.__fs(remote.apply, changed)
+                if await self.__fs(remote.count) == total:
+                    return changed
+                # deleted documents don't show up in changed pages
+                logger.info("Documents removed on web, listing all.")
+            # create time is stable while listing, update time moves documents between pages
+            docs = await self.api.get_docs()
+            await self.__fs(remote.replace, docs)
+            return docs
+        except Exception as e:
+            logger.error(e)
+            logger.error("Listing files from web failed, drift not checked.")
+            return None
+
+    async def __reconcile(self) -> None:
+        """Repair drift between web and local state, found in the remote snapshot.
+        """
+        missing, failed, parsed, duplicates = await self.__fs(self.file_system.remote.find_drift, self.max_parse_retries)
+        if missing:
+            # a deletion while listing moves documents to pages already read, confirm with a second listing
+            try:
+                await self.__fs(self.file_system.remote.replace, await self.api.get_docs())
+            except Exception as e:
+                logger.error(e)
+                logger.error("Listing files from web failed, missing documents not confirmed.")
+                return
+            confirmed = set((await self.__fs(self.file_system.remote.find_drift, self.max_parse_retries))[0])
+            missing = [file_path for file_path in missing if file_path in confirmed]
+        if duplicates:
+            logger.warning("%s duplicate documents on web, deleting them.", len(duplicates))
+            if await self.api.delete_files(duplicates):
+                await self.__fs(self.file_system.remote.remove, duplicates)
+        if missing:
+            # removed in the RAGFlow UI, upload them again
+            logger.warning("%s documents missing on web, uploading them again.", len(missing))
+            await self.__fs(self.file_system.reset_files, missing)
+        if failed:
+            queued = await self.__fs(self.file_system.set_parse_failed, failed, self.max_parse_retries)
+            logger.warning("Parsing of %s documents failed on web, %s marked for parsing again, %s given up.",
+                           len(failed), queued, len(failed) - queued)
+        if parsed:
+            # parsed in the RAGFlow UI
+            logger.info("%s documents already parsed on web.", len(parsed))
+            await self.__fs(self.file_system.set_files_status, parsed, 4)
+
+    async def __update_files(self, to_be_updated: List[Tuple[str, str, str, int]]) -> bool:
+        """Delete old documents of updated files from web, so the files get uploaded as new ones.
+
+        :return: False if deletion failed
+        """
+        if not to_be_updated:
+            return True
+
+        # use delete api to update files, upload follows with new files
+        file_ids = [x[0] for x in to_be_updated]
+        if not await self.api.delete_files(file_ids):
+            return False
+        await self.__fs(self.file_system.remote.remove, file_ids)
+        # old documents are gone, the files are new from now on
+        await self.__fs(self.file_system.reset_files, [x[1] for x in to_be_updated])
+        return True
+
+    async def __parse(self, files: List[Tuple[str, str]], batch_size: int = 100) -> None:
+        """Start parsing files in concurrent batches and set their status to 4.
+
+        :param files: paths and doc ids of files
+        """
+        batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+        # use parse api to parse files
+        results = await asyncio.gather(*(self.api.parse_files([x[1] for x in batch]) for batch in batches))
+        # update file status to 4
+        await self.__fs(self.file_system.set_files_status, [x[0] for batch, ok in zip(batches, results) if ok for x in batch], 4)
+
+    async def __upload(self, files: List[Tuple[str, str, int]]) -> Tuple[List[Tuple[str, str]], bool]:
+        """Upload small files in batches and large files one by one, both lanes at the same time.
+
+        :param files: path, name and size of files
+        :return: paths and names of uploaded files, and whether all files not skipped were uploaded
+        """
+        if not files:
+            return [], True
+        small_files, large_files = await self.__fs(self.file_system.split_by_size, files)
+        # oversized files deferred by policy go last, after all other uploads
+        deferred = [x for x in large_files if self.file_system.max_file_size and x[2] > self.file_system.max_file_size]
+        large_files = large_files[:len(large_files) - len(deferred)]
+
+        lanes = await asyncio.gather(self.__upload_batches(small_files), self.__upload_large_files(large_files))
+        uploaded = lanes[0] + lanes[1] + await self.__upload_large_files(deferred)
+        return uploaded, len(uploaded) == len(small_files) + len(large_files) + len(deferred)
+
+    async def __upload_batches(self, files: List[Tuple[str, str, int]]) -> List[Tuple[str, str]]:
+        """Upload files in batches sized by the adaptive batch limit and batch_bytes, bounded by the in-flight limit.
+
+        :return: paths and names of uploaded files
+        """
+        batch_size = self.api.batch_limiter.limit
+        batches = []
+        batch_bytes = 0
+        for file in files:
+            # at least one file per batch
+            if batches and len(batches[-1]) < batch_size and batch_bytes + file[2] <= self.batch_bytes:
+                batches[-1].append(file)
+                batch_bytes += file[2]
+            else:
+                batches.append([file])
+                batch_bytes = file[2]
+        results = await asyncio.gather(*(self.api.upload_files([x[0] for x in batch], [x[1] for x in batch]) for batch in batches))
+        return [(x[0], x[1]) for batch, ok in zip(batches, results) if ok for x in batch]
+
+    async def __upload_large_files(self, files: List[Tuple[str, str, int]]) -> List[Tuple[str, str]]:
+        """Upload large files one per request, bounded by the large file lane.
+
+        :return: paths and names of uploaded files
+        """
+        results = await asyncio.gather(*(self.api.upload_large_file(file_path, file_name) for file_path, file_name, _ in files))
+        return [(x[0], x[1]) for x, ok in zip(files, results) if ok]
+
+    async def __fs(self, func, *args):
+        """Run a file system call in the worker thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
@@ -8,72 +8,326 @@ Version: 0.1.0
 """
 
 import time
-from typing import List
+from datetime import datetime
+from typing import List, Optional, Tuple
 from filesystem.wwfilesystem import FileSystem
 from api.wwapi import WebApi
+from utils.wwlog import logger
+from utils.wwschedule import Scheduler
+from utils.wwcontrol import CircuitBreaker
 
 
 class Manager:
     """Manager of RAGFlow knowledge base files.
     """
-    def __init__(self, root_path: str, suffixes: List[str], url_base: str, email: str, password: str, kb_id: str, period: int = 1):
-        self.file_system = FileSystem(root_path, suffixes)
-        self.api = WebApi(url_base, email, password, kb_id)
+    def __init__(self, root_path: str, suffixes: List[str], url_base: str, email: str, password: str, kb_id: str, period: float = 1,
+                 large_file_size: int = 64 * 1024 * 1024, max_file_size: int = 0, max_size_policy: str = "skip",
+                 batch_bytes: int = 32 * 1024 * 1024, large_timeout: float = 600.0, cron: str = "",
+                 windows: Optional[List[str]] = None, parse_strategy: str = "", scan_interval: float = 30, upload_rate: float = 0,
+                 full_listing_interval: float = 1, max_parse_retries: int = 3):
+        """
+        :param period: period of network cycles in days, 0 for every scan
+        :param cron: cron expression of network cycles, overrides period
+        :param windows: daily time windows such as "22:00-06:00" for uploads, empty for any time
+        :param parse_strategy: "" to leave parsing to RAGFlow, "immediate" to parse every network cycle,
+         "offpeak" to parse inside windows only
+        :param scan_interval: seconds between local scans
+        :param upload_rate: upload bytes per second, 0 for no limit
+        :param full_listing_interval: days between full listings of web, other cycles list changed documents only
+        :param max_parse_retries: times a file whose parsing failed on web is parsed again before giving up
+        """
+        if parse_strategy not in ("", "immediate", "offpeak"):
+            raise ValueError(f"Unknown parse strategy {parse_strategy}.")
+        self.file_system = FileSystem(root_path, suffixes, large_file_size, max_file_size, max_size_policy, full_listing_interval)
+        self.api = WebApi(url_base, email, password, kb_id, large_timeout = large_timeout, upload_rate = upload_rate)
         self.period = period
+        self.batch_bytes = batch_bytes  # max total size of an upload batch
+        self.scheduler = Scheduler(period, cron, windows, scan_interval)
+        self.parse_strategy = parse_strategy
+        self.scan_interval = scan_interval
+        self.max_parse_retries = max_parse_retries
         
-    def run(self) -> None:
-        # login to web
-        if not self.api.login():
-            return
+    def run(self, once: bool = False) -> None:
+        """Run manager cycles, scanning continuously and syncing with web when scheduled.
 
+        :param once: run a single cycle and return
+        :return: None
+        """
+        next_sync = datetime.now()
         while True:
-            # connect to file system
-            self.file_system.connect()
+            now = datetime.now()
+            if now >= next_sync:
+                if self.run_once(self.scheduler.in_window(now)):
+                    next_sync = self.scheduler.next_run(datetime.now())
+                else:
+                    # deferred outside of windows, or server down, retry after a scan interval at least
+                    next_sync = self.scheduler.next_retry(datetime.now())
+                logger.info("Next sync at %s.", next_sync)
+                # next sync is a scan interval away at least
+                wait = self.scan_interval
+            else:
+                self.scan_once()
+                # wake up for the next scan, or the next sync if it comes first
+                wait = min(self.scan_interval, (next_sync - datetime.now()).total_seconds())
+            if once:
+                return
 
-            # check database and initialize it if not initialized
-            self.file_system.check_db()
+            time.sleep(max(0.0, wait))
 
-            # update all files
-            if to_be_deleted := self.file_system.update_files():
-                # use delete api to delete files
-                self.api.delete_files(to_be_deleted)
-            # upload new files
-            if to_be_uploaded := self.file_system.get_new_files():
-                # use upload api to upload files
-                file_paths = [x[0] for x in to_be_uploaded]
-                file_names = [x[1] for x in to_be_uploaded]
-                self.api.upload_files(file_paths, file_names)
-                # get file lists to read their ids
-                file_lists = self.api.get_files()
-                web_file_names = [x[0] for x in file_lists]
-                web_file_ids = [x[1] for x in file_lists]
-                # update file status to 3
-                for file_name, file_id in zip(web_file_names, web_file_ids):
-                    self.file_system.db.update("ragflow", "status = ?, doc_id = ?", "filename = ?", (3, file_id, file_name))
+    def scan_once(self) -> None:
+        """Scan local files only, without network work.
+
+        :return: None
+        """
+        self.file_system.connect()
+        self.file_system.check_db()
+        self.file_system.scan_files()
+        self.file_system.disconnect()
+
+    def bootstrap(self) -> bool:
+        """Rebuild the database from the knowledge base on web, so that only missing files get uploaded.
+
+        :return: True if rebuilt
+        """
+        self.file_system.connect()
+        self.file_system.check_db()
+
+        try:
+            if not self.api.login():
+                logger.error("Login failed, database not rebuilt.")
+                return False
+            self.file_system.rebuild(self.api.iter_files())
+            self.file_system.set_meta("authorization", self.api.headers["Authorization"])
+            return True
+        except Exception as e:
+            logger.error(e)
+            logger.error("Listing files from web failed, database not rebuilt.")
+            return False
+        finally:
+            self.file_system.disconnect()
+
+    def run_once(self, bulk: bool = True) -> bool:
+        """Run a single manager cycle.
+
+        :param bulk: do bulk upload and parse work, False outside of windows
+        :return: True if the cycle was done with bulk work and its web calls succeeded
+        """
+        # connect to file system
+        self.file_system.connect()
+
+        # check database and initialize it if not initialized
+        self.file_system.check_db()
+
+        # server is down, keep scanning locally and defer network work to the next cycle
+        if self.api.breaker.is_open():
+            logger.warning("RAGFlow unavailable, network work deferred.")
+            self.file_system.scan_files()
+            self.file_system.disconnect()
+            return False
+
+        # reuse cached authorization, login only if there is none
+        if not self.api.headers["Authorization"]:
+            self.api.headers["Authorization"] = self.file_system.get_meta("authorization") or ""
+        if not self.api.ensure_login():
+            logger.error("Login failed, retry in next cycle.")
+            self.file_system.disconnect()
+            return False
+
+        # failed web calls make the cycle retried soon instead of at the next scheduled sync
+        done = True
+
+        # update all files
+        if to_be_deleted := self.file_system.update_files():
+            # use delete api to delete files, records are kept for next cycle if it fails
+            if self.api.delete_files(to_be_deleted):
+                self.file_system.remove_files(to_be_deleted)
+                self.file_system.remote.remove(to_be_deleted)
+            else:
+                done = False
+
+        if bulk:
             # update updated files
             if to_be_updated := self.file_system.get_updated_files():
                 # use delete and upload api to update files
-                # here should consider file is changed but not uploaded yet
                 file_ids = [x[0] for x in to_be_updated]
-                file_paths = [x[1] for x in to_be_updated]
-                file_names = [x[2] for x in to_be_updated]
-                self.api.delete_files(file_ids)
-                self.api.upload_files(file_paths, file_names)
-                # update file status to 3
-                for file_path in file_paths:
-                    self.file_system.db.update("ragflow", "status = ?", "path = ?", (3, file_path))
-            # start to parse files
+                if self.api.delete_files(file_ids):
+                    # old documents are gone, the files are uploaded as new ones
+                    self.file_system.remote.remove(file_ids)
+                    self.file_system.reset_files([x[1] for x in to_be_updated])
+                else:
+                    done = False
+            # upload new and updated files together, so deferred files go after all of them
+            uploaded = []
+            if to_be_uploaded := self.file_system.get_new_files():
+                # use upload api to upload files
+                uploaded, complete = self.__upload(to_be_uploaded)
+                done = done and complete
+        else:
+            uploaded = []
+            logger.info("Outside of upload windows, uploads deferred.")
+
+        # list documents changed on web, including the ones just uploaded
+        if (remote_docs := self.__refresh_remote()) is not None:
+            if uploaded:
+                self.__record_uploaded(uploaded, remote_docs)
+            self.__reconcile()
+        else:
+            done = False
+
+        # start to parse files, including the ones whose parsing failed on web
+        if self.parse_strategy == "immediate" or (self.parse_strategy == "offpeak" and bulk):
             if to_be_parsed := self.file_system.get_unprocessed_files():
-                # use parse api to parse files
-                ...
+                self.__parse(to_be_parsed)
+
+        # save authorization if it was renewed
+        if self.api.headers["Authorization"] != self.file_system.get_meta("authorization"):
+            self.file_system.set_meta("authorization", self.api.headers["Authorization"])
+
+        # a circuit not closed means some calls failed, and only a retry lets it probe the server
+        if self.api.breaker.state != CircuitBreaker.CLOSED:
+            done = False
+        if bulk and not done:
+            logger.warning("Sync incomplete, retry after the next scan.")
+
+        # disconnect from file system
+        self.file_system.disconnect()
+        return bulk and done
+
+    def __record_uploaded(self, files: List[Tuple[str, str]], remote_docs: List[dict]) -> None:
+        """Read doc ids of uploaded files from the listing and set their status to 3.
+
+        :param files: paths and names of uploaded files
+        :param remote_docs: documents listed from web, newest first
+        :return: None
+        """
+        web_file_ids = {}
+        for doc in remote_docs:
+            # newest document of a name is the one just uploaded
+            web_file_ids.setdefault(doc.get("name"), doc.get("id"))
+        self.file_system.set_files_uploaded([(file_path, web_file_ids[file_name])
+                                             for file_path, file_name in files if file_name in web_file_ids])
+
+    def __refresh_remote(self) -> Optional[List[dict]]:
+        """Bring the remote snapshot up to date, listing only documents changed since the last refresh when possible.
+
+        :return: documents listed, newest first, or None if listing failed
+        """
+        remote = self.file_system.remote
+        try:
+            if not remote.needs_full_listing():
+                changed, page = [], 1
+                while True:
+                    docs, total = self.api.list_files(page, "update_time")
+                    changed += docs
+                    if remote.is_caught_up(docs) or page * 100 >= total:
+                        break
+                    page += 1
+                remote.apply(changed)
+                if remote.count() == total:
+                    return changed
+                # deleted documents don't show up in changed pages
+                logger.info("Documents removed on web, listing all.")
+            # create time is stable while listing, update time moves documents between pages
+            docs = list(self.api.iter_files())
+            remote.replace(docs)
+            return docs
+        except Exception as e:
+            logger.error(e)
+            logger.error("Listing files from web failed, drift not checked.")
+            return None
+
+    def __reconcile(self) -> None:
+        """Repair drift between web and local state, found in the remote snapshot.
+
+        :return: None
+        """
+        missing, failed, parsed, duplicates = self.file_system.remote.find_drift(self.max_parse_retries)
+        if missing:
+            # a deletion while listing moves documents to pages already read, confirm with a second listing
+            try:
+                self.file_system.remote.replace(list(self.api.iter_files()))
+            except Exception as e:
+                logger.error(e)
+                logger.error("Listing files from web failed, missing documents not confirmed.")
+                return
+            confirmed = set(self.file_system.remote.find_drift(self.max_parse_retries)[0])
+            missing = [file_path for file_path in missing if file_path in confirmed]
+        if duplicates:
+            logger.warning("%s duplicate documents on web, deleting them.", len(duplicates))
+            if self.api.delete_files(duplicates):
+                self.file_system.remote.remove(duplicates)
+        if missing:
+            # removed in the RAGFlow UI, upload them again
+            logger.warning("%s documents missing on web, uploading them again.", len(missing))
+            self.file_system.reset_files(missing)
+        if failed:
+            queued = self.file_system.set_parse_failed(failed, self.max_parse_retries)
+            logger.warning("Parsing of %s documents failed on web, %s marked for parsing again, %s given up.",
+                           len(failed), queued, len(failed) - queued)
+        if parsed:
+            # parsed in the RAGFlow UI
+            logger.info("%s documents already parsed on web.", len(parsed))
+            self.file_system.set_files_status(parsed, 4)
+
+    def __parse(self, files: List[Tuple[str, str]], batch_size: int = 100) -> None:
+        """Start parsing files in batches and set their status to 4.
+
+        :param files: paths and doc ids of files
+        :return: None
+        """
+        for start in range(0, len(files), batch_size):
+            if self.api.breaker.is_open():
+                logger.warning("RAGFlow unavailable, remaining parsing deferred.")
+                break
+            batch = files[start:start + batch_size]
+            # use parse api to parse files
+            if self.api.parse_files([x[1] for x in batch]):
                 # update file status to 4
-                for file_path in to_be_parsed:
-                    # self.file_system.db.update("ragflow", "status = ?", "path = ?", (4, file_path))
-                    ...
+                self.file_system.set_files_status([x[0] for x in batch], 4)
 
-            # disconnect from file system
-            self.file_system.disconnect()
+    def __upload(self, files: List[Tuple[str, str, int]]) -> Tuple[List[Tuple[str, str]], bool]:
+        """Upload small files in batches and large files one by one.
+
+        :param files: path, name and size of files
+        :return: paths and names of uploaded files, and whether all files not skipped were uploaded
+        """
+        small_files, large_files = self.file_system.split_by_size(files)
+        uploaded = self.__upload_batches(small_files) + self.__upload_large_files(large_files)
+        return uploaded, len(uploaded) == len(small_files) + len(large_files)
+
+    def __upload_batches(self, files: List[Tuple[str, str, int]]) -> List[Tuple[str, str]]:
+        """Upload files in batches sized by the adaptive batch limit and batch_bytes.
+
+        :return: paths and names of uploaded files
+        """
+        uploaded = []
+        start = 0
+        while start < len(files):
+            if self.api.breaker.is_open():
+                logger.warning("RAGFlow unavailable, remaining uploads deferred.")
+                break
+            # at least one file per batch
+            end = start + 1
+            batch_bytes = files[start][2]
+            while end < len(files) and end - start < self.api.batch_limiter.limit and batch_bytes + files[end][2] <= self.batch_bytes:
+                batch_bytes += files[end][2]
+                end += 1
+            batch = files[start:end]
+            if self.api.upload_files([x[0] for x in batch], [x[1] for x in batch]):
+                uploaded.extend((x[0], x[1]) for x in batch)
+            start = end
+        return uploaded
+
+    def __upload_large_files(self, files: List[Tuple[str, str, int]]) -> List[Tuple[str, str]]:
+        """Upload large files one by one, streaming them.
 
-            # sleep for period days
-            # time.sleep(self.period * 24 * 60 * 60)
-            time.sleep(30)  # for debug
+        :return: paths and names of uploaded files
+        """
+        uploaded = []
+        for file_path, file_name, _ in files:
+            if self.api.breaker.is_open():
+                logger.warning("RAGFlow unavailable, remaining large uploads deferred.")
+                break
+            if self.api.upload_large_file(file_path, file_name):
+                uploaded.append((file_path, file_name))
+        return uploaded
@@ -0,0 +1,129 @@
+"""
+Module File: wwcontrol.py
+Description: This module contains adaptive concurrency control and circuit breaker for web calls.
+
+Author: Icingworld
+Date: 2025-03-26
+Version: 0.1.0
+"""
+
+import time
+from typing import Optional
+from .wwlog import logger
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused because the circuit is open.
+    """
+
+
+class AdaptiveLimiter:
+    """AIMD limiter, raises the limit additively while calls are healthy and
+    cuts it multiplicatively on timeouts, 429s, 5xx or slow responses.
+
+    Not thread safe, meant to be used from one thread or one event loop.
+    """
+    def __init__(self, name: str, initial: int = 4, minimum: int = 1, maximum: int = 64,
+                 decrease: float = 0.5, latency_target: float = 10.0):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.value = float(initial)
+        self.last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        """Current limit.
+        """
+        return int(self.value)
+
+    def success(self, latency: Optional[float] = None) -> None:
+        """Record a successful call.
+
+        :param latency: call latency in seconds, None if it says nothing about server load
+        :return: None
+        """
+        if latency is not None and latency > self.latency_target:
+            # slow answer means the server is saturated
+            self.overload()
+            return
+        # about +1 once every `limit` healthy calls
+        self.value = min(self.maximum, self.value + 1 / self.value)
+
+    def overload(self) -> None:
+        """Record an overloaded call (timeout, 429, 5xx or slow answer).
+
+        :return: None
+        """
+        now = time.monotonic()
+        # calls in flight when the server got saturated fail together, back off once for them
+        if now - self.last_decrease < self.latency_target:
+            return
+        self.last_decrease = now
+        old_limit = self.limit
+        self.value = max(self.minimum, self.value * self.decrease)
+        if self.limit != old_limit:
+            logger.info("Limit %s decreased from %s to %s.", self.name, old_limit, self.limit)
+
+
+class CircuitBreaker:
+    """Circuit breaker, opens after consecutive failures and lets a single probe
+    through every recovery_time seconds until the server answers again.
+
+    Not thread safe, meant to be used from one thread or one event loop.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def is_open(self) -> bool:
+        """Check whether calls are refused now, without taking the probe.
+
+        :return: True if open and not yet due for a probe
+        """
+        return self.state == self.HALF_OPEN or (
+            self.state == self.OPEN and time.monotonic() - self.opened_at < self.recovery_time)
+
+    def allow(self) -> bool:
+        """Check whether a call may be made now.
+
+        :return: True if closed, or if this call is the probe of an open circuit
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_time:
+            logger.info("Circuit half-open, probing server.")
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def success(self) -> None:
+        """Record a call the server answered.
+
+        :return: None
+        """
+        if self.state != self.CLOSED:
+            logger.info("Server answered, circuit closed.")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def failure(self) -> None:
+        """Record a call the server failed to answer.
+
+        :return: None
+        """
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("Server unavailable, circuit open for %s seconds.", self.recovery_time)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
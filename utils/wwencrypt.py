@@ -8,8 +8,23 @@ Version: 0.1.0
 """
 
 import base64
-from Crypto.Cipher import PKCS1_v1_5 as Cipher_pksc1_v1_5
-from Crypto.PublicKey import RSA
+from functools import lru_cache
+
+
+@lru_cache(maxsize = None)
+def load_cipher(pub: str):
+    """Parse public key and create cipher, cached by public key.
+
+    :param pub: public key
+    :return: PKCS1_v1_5 cipher
+    """
+    # pycryptodome is only needed on login, import it lazily
+    from Crypto.Cipher import PKCS1_v1_5 as Cipher_pksc1_v1_5
+    from Crypto.PublicKey import RSA
+
+    rsakey = RSA.importKey(pub)
+    return Cipher_pksc1_v1_5.new(rsakey)
+
 
 def rsa_psw(password: str, pub: str) -> str:
     """RSA encryption for password.
@@ -19,8 +34,7 @@ def rsa_psw(password: str, pub: str) -> str:
     :return: encrypted password
     """
     # load public key
-    rsakey = RSA.importKey(pub)
-    cipher = Cipher_pksc1_v1_5.new(rsakey)
+    cipher = load_cipher(pub)
 
     # encrypt password and return
     password_b64 = base64.b64encode(password.encode())
@@ -30,12 +30,12 @@ def calculate_file_hash_content_binary(content: bytes, algorithm: str = "sha256"
     return hash_func.hexdigest()
 
 # @timeit("calculate_file_hash used", "ms")
-def calculate_file_hash(file_path: str, algorithm: str = "sha256", chunk_size: int = 4096) -> str:
+def calculate_file_hash(file_path: str, algorithm: str = "sha256", chunk_size: int = 1024 * 1024) -> str:
     """Calculate the hash value of a file.
 
     :param file_path: path of the file
     :param algorithm: hash algorithm, supporting "sha256", "md5", etc.  default is sha256
-    :param chunk_size: chunk size for reading file, default is 4096
+    :param chunk_size: chunk size for reading file, default is 1 MiB
     :return: hash value of the file
     """
     hash_func = hashlib.new(algorithm)
@@ -7,7 +7,54 @@ Date: 2025-03-14
 Version: 0.1.0
 """
 
+import atexit
 import logging
+import logging.handlers
+import queue
+import time
+from typing import Dict, List, Optional, Union
+
+
+LIMITED = {"rate_limited": True}  # extra of rate limited records
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler which leaves formatting to the listener thread.
+
+    Arguments are formatted later, so they must not be mutated after logging.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """Let at most `burst` records of the same message through every `interval` seconds.
+
+    Only records logged with limit=True are limited, they are told apart by their
+    unformatted message, so "File %s already up-to-date." counts as one message.
+    """
+    def __init__(self, burst: int = 10, interval: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows: Dict[str, List] = {}  # message -> [window start, passed, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "rate_limited", False):
+            return True
+
+        now = time.monotonic()
+        window = self.windows.get(record.msg)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            window = self.windows[record.msg] = [now, 0, 0]
+            if suppressed:
+                record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        if window[1] >= self.burst:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
 
 
 class Logger:
@@ -21,26 +68,68 @@ class Logger:
         console_handler.setLevel(logging.DEBUG)
 
         # create formatter
-        formatter = logging.Formatter("[%(asctime)s][%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
-        console_handler.setFormatter(formatter)
+        self.formatter = logging.Formatter("[%(asctime)s][%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+        console_handler.setFormatter(self.formatter)
+
+        # records are queued on the hot path, a listener thread formats and writes them
+        self.queue = queue.SimpleQueue()
+        self.rate_limit = RateLimitFilter()
+        queue_handler = LazyQueueHandler(self.queue)
+        queue_handler.addFilter(self.rate_limit)
+        self.logger.addHandler(queue_handler)
+
+        self.handlers = [console_handler]
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def configure(self, level: Union[int, str] = logging.DEBUG, file: Optional[str] = None, max_bytes: int = 10 * 1024 * 1024,
+                  backup_count: int = 5, burst: int = 10, interval: float = 60.0) -> None:
+        """Configure logging.
+
+        :param level: logging level, such as "INFO" or logging.INFO
+        :param file: also write to this file, rotating it, if given
+        :param max_bytes: rotate the file when it reaches this size
+        :param backup_count: number of rotated files to keep
+        :param burst: max records of the same rate limited message per interval
+        :param interval: interval of rate limited messages in seconds
+        :return: None
+        """
+        self.logger.setLevel(level.upper() if isinstance(level, str) else level)
+        self.rate_limit.burst = burst
+        self.rate_limit.interval = interval
+
+        if file:
+            file_handler = logging.handlers.RotatingFileHandler(file, maxBytes=max_bytes, backupCount=backup_count,
+                                                                encoding="utf-8")
+            file_handler.setFormatter(self.formatter)
+            # handlers of a running listener can't be changed, restart it
+            self.listener.stop()
+            self.handlers.append(file_handler)
+            self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self.listener.start()
+
+    def stop(self) -> None:
+        """Flush queued records and stop the listener thread, called on exit.
 
-        # add console handler to logger
-        self.logger.addHandler(console_handler)
+        :return: None
+        """
+        self.listener.stop()
 
-    def debug(self, msg):
-        self.logger.debug(msg)
+    def debug(self, msg, *args, limit: bool = False):
+        self.logger.debug(msg, *args, extra=LIMITED if limit else None)
 
-    def info(self, msg):
-        self.logger.info(msg)
+    def info(self, msg, *args, limit: bool = False):
+        self.logger.info(msg, *args, extra=LIMITED if limit else None)
 
-    def warning(self, msg):
-        self.logger.warning(msg)
+    def warning(self, msg, *args, limit: bool = False):
+        self.logger.warning(msg, *args, extra=LIMITED if limit else None)
 
-    def error(self, msg):
-        self.logger.error(msg)
+    def error(self, msg, *args, limit: bool = False):
+        self.logger.error(msg, *args, extra=LIMITED if limit else None)
 
-    def critical(self, msg):
-        self.logger.critical(msg)
+    def critical(self, msg, *args, limit: bool = False):
+        self.logger.critical(msg, *args, extra=LIMITED if limit else None)
 
 
 logger = Logger()
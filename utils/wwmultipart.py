@@ -0,0 +1,137 @@
+"""
+Module File: wwmultipart.py
+Description: This module contains a streaming multipart/form-data body for uploading files.
+
+Author: Icingworld
+Date: 2025-03-28
+Version: 0.1.0
+"""
+
+import os
+import uuid
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+
+class MultipartFileStream:
+    """File-like multipart/form-data body of one or more files, read from disk chunk by chunk.
+
+    requests builds multipart bodies in memory, passing this object as `data` streams
+    the files instead, with a known Content-Length. Files are opened one at a time.
+    """
+    def __init__(self, files: List[Tuple[str, str]], field: str = "file", fields: Optional[Dict[str, str]] = None,
+                 chunk_size: int = 1024 * 1024, throttle: Optional[Callable[[int], None]] = None):
+        """
+        :param files: paths and names of files
+        :param throttle: called with the size of every chunk read from a file, to limit bandwidth
+        """
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+
+        # bytes of the headers and paths of the files, in body order
+        head = b""
+        for name, value in (fields or {}).items():
+            head += (f"--{self.boundary}\r\n"
+                     f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                     f"{value}\r\n").encode()
+        self.segments: List[Union[bytes, str]] = []
+        self.sizes: List[int] = []
+        for file_path, file_name in files:
+            head += (f"--{self.boundary}\r\n"
+                     f"Content-Disposition: form-data; name=\"{field}\"; filename=\"{self.__escape(file_name)}\"\r\n"
+                     f"Content-Type: application/octet-stream\r\n\r\n").encode()
+            self.__add(head)
+            self.__add(file_path, os.stat(file_path).st_size)
+            head = b"\r\n"
+        self.__add(head + f"--{self.boundary}--\r\n".encode())
+        self.length = sum(self.sizes)
+
+        self.index = 0  # current segment
+        self.offset = 0  # position in current segment
+        self.position = 0
+        self.file: Optional[BinaryIO] = None
+
+    @property
+    def content_type(self) -> str:
+        """Content-Type header of the body.
+        """
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes of the body.
+
+        :param size: max bytes to read, -1 for the rest of the body
+        :return: bytes read, empty at the end of the body
+        """
+        if size is None or size < 0:
+            size = self.length - self.position
+        res = b""
+        while len(res) < size and self.index < len(self.segments):
+            want = min(size - len(res), self.sizes[self.index] - self.offset)
+            segment = self.segments[self.index]
+            if isinstance(segment, bytes):
+                chunk = segment[self.offset:self.offset + want]
+            else:
+                if self.file is None:
+                    self.file = open(segment, "rb")
+                chunk = self.file.read(want)
+                if len(chunk) < want:
+                    raise IOError(f"File {segment} shrank while uploading.")
+                if self.throttle:
+                    self.throttle(len(chunk))
+            res += chunk
+            self.offset += len(chunk)
+            self.position += len(chunk)
+            if self.offset == self.sizes[self.index]:
+                # segment done, move on to the next one
+                self.close()
+                self.index += 1
+                self.offset = 0
+        return res
+
+    def __iter__(self) -> Iterator[bytes]:
+        while chunk := self.read(self.chunk_size):
+            yield chunk
+
+    def seek(self, offset: int) -> None:
+        """Rewind the body, only rewinding to the start is supported.
+
+        :param offset: must be 0
+        :return: None
+        """
+        if offset != 0:
+            raise ValueError("MultipartFileStream can only be rewound to the start.")
+        self.close()
+        self.index = 0
+        self.offset = 0
+        self.position = 0
+
+    def close(self) -> None:
+        """Close the file being read, if any.
+
+        :return: None
+        """
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self) -> "MultipartFileStream":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __add(self, segment: Union[bytes, str], size: Optional[int] = None) -> None:
+        """Append bytes, or a file path with its size, to the body.
+        """
+        self.segments.append(segment)
+        self.sizes.append(len(segment) if size is None else size)
+
+    @staticmethod
+    def __escape(value: str) -> str:
+        """Escape a header parameter value the way browsers do.
+        """
+        return value.replace("\"", "%22").replace("\r", "%0D").replace("\n", "%0A")
@@ -0,0 +1,163 @@
+"""
+Module File: wwschedule.py
+Description: This module contains scheduling of manager cycles, by period or cron expression, within time windows.
+
+Author: Icingworld
+Date: 2025-04-02
+Version: 0.1.0
+"""
+
+from datetime import datetime, time, timedelta
+from typing import List, Optional, Set
+
+
+class CronExpression:
+    """Five fields cron expression: minute hour day-of-month month day-of-week.
+
+    Fields support "*", lists "1,2", ranges "1-5" and steps "*/15" or "1-30/2".
+    Day of week is 0-7, both 0 and 7 are Sunday.
+    """
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression {expression} must have 5 fields.")
+        self.expression = expression
+        self.minutes = self.__parse(fields[0], 0, 59)
+        self.hours = self.__parse(fields[1], 0, 23)
+        self.days = self.__parse(fields[2], 1, 31)
+        self.months = self.__parse(fields[3], 1, 12)
+        self.weekdays = {day % 7 for day in self.__parse(fields[4], 0, 7)}
+        # cron matches either day field when both are restricted
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def next_after(self, now: datetime) -> datetime:
+        """Get the first matching minute after now.
+
+        :param now: time to start from
+        :return: next matching time
+        """
+        moment = now.replace(second = 0, microsecond = 0) + timedelta(minutes = 1)
+        limit = moment + timedelta(days = 5 * 366)
+        while moment < limit:
+            if moment.month not in self.months:
+                # first day of next month
+                moment = (moment.replace(day = 1) + timedelta(days = 32)).replace(day = 1, hour = 0, minute = 0)
+            elif not self.__match_day(moment):
+                moment = moment.replace(hour = 0, minute = 0) + timedelta(days = 1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute = 0) + timedelta(hours = 1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes = 1)
+            else:
+                return moment
+        raise ValueError(f"Cron expression {self.expression} never matches.")
+
+    def __match_day(self, moment: datetime) -> bool:
+        """Check day of month and day of week.
+        """
+        day = moment.day in self.days
+        # isoweekday is 1-7 from Monday, cron is 0-6 from Sunday
+        weekday = moment.isoweekday() % 7 in self.weekdays
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    @staticmethod
+    def __parse(field: str, minimum: int, maximum: int) -> Set[int]:
+        """Parse one field into the set of matching values.
+        """
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+            if part == "*":
+                start, end = minimum, maximum
+            elif "-" in part:
+                start, end = (int(x) for x in part.split("-", 1))
+            else:
+                start = int(part)
+                end = start if step == 1 else maximum
+            if start < minimum or end > maximum or start > end or step < 1:
+                raise ValueError(f"Cron field {field} out of range {minimum}-{maximum}.")
+            values.update(range(start, end + 1, step))
+        return values
+
+
+class TimeWindow:
+    """Daily time window such as "22:00-06:00", which may wrap over midnight.
+    """
+    def __init__(self, window: str):
+        start, end = window.split("-", 1)
+        self.window = window
+        self.start = time.fromisoformat(start.strip())
+        self.end = time.fromisoformat(end.strip())
+
+    def contains(self, moment: datetime) -> bool:
+        """Check whether moment is inside the window.
+
+        :param moment: time to check
+        :return: True if inside
+        """
+        now = moment.time()
+        if self.start <= self.end:
+            return self.start <= now < self.end
+        return now >= self.start or now < self.end
+
+    def next_start(self, moment: datetime) -> datetime:
+        """Get the first start of the window after moment.
+
+        :param moment: time to start from
+        :return: next start of the window
+        """
+        start = datetime.combine(moment.date(), self.start)
+        return start if start > moment else start + timedelta(days = 1)
+
+
+class Scheduler:
+    """Decides when network cycles are due and whether bulk work is allowed now.
+    """
+    def __init__(self, period: float = 0, cron: str = "", windows: Optional[List[str]] = None, scan_interval: float = 30):
+        """
+        :param period: period of network cycles in days, 0 for every scan
+        :param cron: cron expression of network cycles, overrides period
+        :param windows: time windows allowing bulk upload and parse work, empty for any time
+        :param scan_interval: seconds between local scans, also the shortest time between network cycles
+        """
+        self.period = timedelta(days = period)
+        self.cron = CronExpression(cron) if cron else None
+        self.windows = [TimeWindow(window) for window in windows or []]
+        self.scan_interval = timedelta(seconds = scan_interval)
+
+    def next_run(self, now: datetime) -> datetime:
+        """Get the time of the next network cycle after a cycle done with its work.
+
+        :param now: time the current cycle ended
+        :return: time of the next cycle
+        """
+        if self.cron:
+            return max(self.cron.next_after(now), now + self.scan_interval)
+        return now + max(self.period, self.scan_interval)
+
+    def next_retry(self, now: datetime) -> datetime:
+        """Get the time to retry a network cycle whose work was deferred.
+
+        :param now: time the current cycle ended
+        :return: next scan, or the next window start if outside of windows
+        """
+        retry = now + self.scan_interval
+        if not self.in_window(now):
+            retry = max(retry, min(window.next_start(now) for window in self.windows))
+        return retry
+
+    def in_window(self, now: datetime) -> bool:
+        """Check whether bulk work is allowed now.
+
+        :param now: time to check
+        :return: True if inside a window, or if no window is set
+        """
+        return not self.windows or any(window.contains(now) for window in self.windows)
@@ -9,7 +9,7 @@ Version: 0.1.0
 """
 
 import sqlite3
-from typing import Any, List, Tuple, Optional
+from typing import Any, Iterable, List, Tuple, Optional
 from .wwlog import logger
 
 
@@ -70,6 +70,37 @@ class SQLiteDB:
         query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
         self.execute(query, values)
     
+    def replace_all(self, table: str, columns: str, rows: Iterable[Tuple]) -> None:
+        """Replace all data of a table in one transaction.
+
+        :param table: table name
+        :param columns: table columns
+        :param rows: new table values
+        :return: None
+        """
+        placeholders = ', '.join(['?'] * len(columns.split(",")))
+        try:
+            self.cursor.execute(f"DELETE FROM {table}")
+            self.cursor.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def execute_many(self, statements: Iterable[Tuple[str, Iterable[Tuple]]]) -> None:
+        """Execute statements, each with many params, in one transaction.
+
+        :param statements: sql queries with their lists of params
+        :return: None
+        """
+        try:
+            for query, rows in statements:
+                self.cursor.executemany(query, rows)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
     def update(self, table: str, set_clause: str, condition: str, params: Tuple) -> None:
         """Update data in database.
 
@@ -0,0 +1,57 @@
+"""
+Module File: wwthrottle.py
+Description: This module contains the token bucket used to limit upload bandwidth.
+
+Author: Icingworld
+Date: 2025-04-02
+Version: 0.1.0
+"""
+
+import time
+
+
+class TokenBucket:
+    """Token bucket of bytes per second.
+
+    Consumers take what they need at once and wait until the bucket is out of debt,
+    so a read larger than the burst is fine, it only waits longer.
+    """
+    def __init__(self, rate: float, burst: float = 0):
+        """
+        :param rate: bytes per second
+        :param burst: bytes allowed at once after idling, default is one second of rate
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def consume(self, amount: int) -> None:
+        """Take amount bytes, sleeping while in debt.
+
+        :param amount: number of bytes
+        :return: None
+        """
+        if wait := self.__reserve(amount):
+            time.sleep(wait)
+
+    async def consume_async(self, amount: int) -> None:
+        """Take amount bytes, sleeping while in debt, without blocking the event loop.
+
+        :param amount: number of bytes
+        :return: None
+        """
+        if wait := self.__reserve(amount):
+            # imported here, the blocking client doesn't need asyncio
+            import asyncio
+            await asyncio.sleep(wait)
+
+    def __reserve(self, amount: int) -> float:
+        """Refill, take amount and get seconds to wait.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
@@ -32,7 +32,7 @@ def timeit(msg = None, unit = "ms"):
             }[unit]
             
             display_msg = msg or f"[{func.__name__}] used"
-            logger.debug(f"{display_msg} {time_unit}")
+            logger.debug("%s %s", display_msg, time_unit)
             return result
         return wrapper
     return decorator